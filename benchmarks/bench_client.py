@@ -0,0 +1,166 @@
+# Copyright (c) 2010 Infrae / Technical University Delft. All rights reserved.
+# See also LICENSE.txt
+"""
+Throughput and latency benchmark of the client against the in-process
+Fedora stand-in of fcrepo.testing, so no Fedora server is needed.
+
+Every scenario is run for a number of operations after a warm up, a
+few times over, and the fastest run is reported in operations per second
+and median, mean and 95th percentile latency in milliseconds. Since the
+server runs in the same process, the numbers measure the client side
+(request building, HTTP handling and parsing) plus a cheap local round
+trip.
+
+The results are compared with benchmarks/baseline.json, and the script
+exits with status 1 when a scenario's median latency is more than the
+tolerance above the baseline. The median is the figure least disturbed
+by other work on the machine. Baselines only compare on the machine
+they were made on, so none is shipped: the first run writes one, and
+--save replaces it.
+
+Run with: bin/py benchmarks/bench_client.py [--save] [--tolerance 0.25]
+"""
+import os
+import sys
+import json
+from time import time
+from optparse import OptionParser
+
+from fcrepo.connection import Connection
+from fcrepo.client import FedoraClient
+from fcrepo.testing import FedoraServer
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'baseline.json')
+
+RELS = 'info:fedora/fedora-system:def/relations-external#'
+
+OBJECTS = 200
+
+def setup(client):
+    pids = []
+    for i in range(OBJECTS):
+        pid = client.ingestObject(u'bench:%s' % i, u'Object %s' % i)
+        client.addDatastream(pid, 'RELS-EXT')
+        rels = client.getObject(pid)['RELS-EXT']
+        rels[RELS + 'isMemberOf'] = [{'value': u'info:fedora/bench:0',
+                                      'type': 'uri'}]
+        rels.setContent()
+        pids.append(pid)
+    return pids
+
+def get_object(client, pids, i):
+    client.getObject(pids[i % len(pids)]).label
+
+def add_datastream(client, pids, i):
+    client.addDatastream(pids[i % len(pids)], 'DS%s' % i, 'x' * 1024,
+                         label=u'Datastream %s' % i, mimeType=u'text/plain',
+                         controlGroup=u'M')
+
+def search_objects(client, pids, i):
+    list(client.searchObjects(u'pid~bench:*', ['pid', 'label', 'state'],
+                              maxResults=100))
+
+def search_triples(client, pids, i):
+    list(client.searchTriples('select $s $p $o from <#ri> where $s $p $o',
+                              lang='itql', limit=1000))
+
+def relsext_round_trip(client, pids, i):
+    rels = client.getObject(pids[i % len(pids)])['RELS-EXT']
+    rels[RELS + 'isPartOf'] = [{'value': u'info:fedora/bench:%s' % i,
+                                'type': 'uri'}]
+    rels.setContent()
+
+def dc_round_trip(client, pids, i):
+    dc = client.getObject(pids[i % len(pids)])['DC']
+    dc['description'] = [u'Description %s' % i]
+    dc.setContent()
+
+SCENARIOS = [('getObject', get_object, 2000),
+             ('addDatastream', add_datastream, 1000),
+             ('searchObjects', search_objects, 100),
+             ('searchTriples', search_triples, 50),
+             ('RELS-EXT round trip', relsext_round_trip, 500),
+             ('DC round trip', dc_round_trip, 500)]
+
+def run(client, pids, function, number, repeat):
+    warm_up = min(number // 10, 50)
+    for i in range(warm_up):
+        function(client, pids, i)
+    best = None
+    for start in range(warm_up, warm_up + number * repeat, number):
+        latencies = []
+        started = time()
+        for i in range(start, start + number):
+            before = time()
+            function(client, pids, i)
+            latencies.append(time() - before)
+        total = time() - started
+        latencies.sort()
+        result = {'ops': number / total,
+                  'median': latencies[number // 2] * 1000,
+                  'mean': sum(latencies) / number * 1000,
+                  'p95': latencies[int(number * 0.95)] * 1000}
+        if best is None or result['median'] < best['median']:
+            best = result
+    return best
+
+def main():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--save', action='store_true', default=False,
+                      help='write the results as the new baseline')
+    parser.add_option('--tolerance', type='float', default=0.25,
+                      help='allowed slowdown of the median latency compared '
+                      'with the baseline, as a fraction (default 0.25)')
+    parser.add_option('--repeat', type='int', default=3,
+                      help='number of runs per scenario (default 3)')
+    parser.add_option('--baseline', default=BASELINE,
+                      help='baseline file (default %default)')
+    options, args = parser.parse_args()
+
+    baseline = {}
+    save = options.save or not os.path.exists(options.baseline)
+    if not save:
+        fp = open(options.baseline)
+        try:
+            baseline = json.load(fp)
+        finally:
+            fp.close()
+
+    server = FedoraServer().start()
+    try:
+        client = FedoraClient(Connection(server.url))
+        pids = setup(client)
+        results = {}
+        regressions = []
+        print '%-22s %8s %10s %10s %10s %9s' % (
+            '', 'ops/s', 'median ms', 'mean ms', 'p95 ms', 'baseline')
+        for name, function, number in SCENARIOS:
+            result = results[name] = run(client, pids, function, number,
+                                         options.repeat)
+            compared = ''
+            if name in baseline:
+                change = result['median'] / baseline[name]['median'] - 1
+                compared = '%+.0f%%' % (change * 100)
+                if change > options.tolerance:
+                    regressions.append(name)
+            print '%-22s %8.0f %10.3f %10.3f %10.3f %9s' % (
+                name, result['ops'], result['median'], result['mean'],
+                result['p95'], compared)
+    finally:
+        server.stop()
+
+    if save:
+        fp = open(options.baseline, 'w')
+        try:
+            json.dump(results, fp, indent=2, sort_keys=True,
+                      separators=(',', ': '))
+        finally:
+            fp.close()
+        print 'Saved the baseline to %s' % options.baseline
+    elif regressions:
+        print 'Slower than the baseline: %s' % ', '.join(regressions)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
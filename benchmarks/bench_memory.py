@@ -0,0 +1,123 @@
+# Copyright (c) 2010 Infrae / Technical University Delft. All rights reserved.
+# See also LICENSE.txt
+"""
+Memory benchmark for search results and object handles.
+
+Compares the bytes held per searchObjects and searchTriples row in the
+default dictionary form with the compact named tuples, and the size of
+FedoraObject and FedoraDatastream instances with and without __slots__.
+Sizes are measured with sys.getsizeof, following containers, and strings
+shared by all rows (like field names) are counted once. No Fedora server
+is needed.
+
+Run with: bin/py benchmarks/bench_memory.py
+"""
+import sys
+from collections import defaultdict, namedtuple
+
+from fcrepo.object import FedoraObject
+from fcrepo.datastream import FedoraDatastream
+
+ROWS = 10000
+
+def deep_size(obj, seen):
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += deep_size(key, seen) + deep_size(value, seen)
+    elif isinstance(obj, (list, tuple)):
+        for item in obj:
+            size += deep_size(item, seen)
+    if hasattr(obj, '__dict__'):
+        size += deep_size(obj.__dict__, seen)
+    for name in getattr(type(obj), '__slots__', ()):
+        if hasattr(obj, name):
+            size += deep_size(getattr(obj, name), seen)
+    return size
+
+def per_row(rows, shared=()):
+    # strings that all rows share are not part of the cost of a row
+    seen = set(id(value) for value in shared)
+    return deep_size(rows, seen) / float(len(rows))
+
+def object_rows(compact):
+    fields = ['pid', 'label', 'state', 'cDate']
+    row_type = namedtuple('ObjectFields', fields)
+    rows = []
+    for i in range(ROWS):
+        data = defaultdict(list)
+        data[u'pid'].append(u'foo:%s' % i)
+        data[u'label'].append(u'Object %s' % i)
+        data[u'state'].append(u'A')
+        data[u'cDate'].append(u'2010-11-04T12:00:00.000Z')
+        if compact:
+            data = row_type._make(tuple(data.get(field, ()))
+                                  for field in fields)
+        rows.append(data)
+    return rows
+
+def triple_rows(compact):
+    row_type = namedtuple('Row', ['s', 'p', 'o'])
+    predicate = u'info:fedora/fedora-system:def/relations-external#isMemberOf'
+    rows = []
+    for i in range(ROWS):
+        values = (u'info:fedora/foo:%s' % i, predicate,
+                  u'info:fedora/collection:%s' % (i % 10))
+        if compact:
+            rows.append(row_type._make(values))
+        else:
+            rows.append(dict((name, {'value': value, 'type': 'uri'})
+                             for name, value in zip('spo', values)))
+    return rows, [predicate]
+
+class NullClient(object):
+    # answers the profile requests of the object and datastream classes
+    graph = None
+
+    def getObjectProfile(self, pid):
+        return {'label': u'Object', 'ownerId': u'fedoraAdmin',
+                'state': u'A', 'createdDate': u'2010-11-04T12:00:00.000Z',
+                'lastModifiedDate': u'2010-11-04T12:00:00.000Z'}
+
+class DictObject(FedoraObject):
+    # a subclass without __slots__ has an instance dictionary again
+    pass
+
+class DictDatastream(FedoraDatastream):
+    pass
+
+def handles(object_class, datastream_class):
+    client = NullClient()
+    result = []
+    for i in range(ROWS):
+        obj = object_class(u'foo:%s' % i, client)
+        result.append((obj, datastream_class('OBJ', obj)))
+    return result, [client]
+
+def report(name, before, after):
+    print '%-28s %10.0f B %10.0f B %6.1fx' % (name, before, after,
+                                             before / after)
+
+def main():
+    print '%-28s %12s %12s %7s' % ('per row', 'before', 'after', '')
+    shared = [u'pid', u'label', u'state', u'cDate', 'value', 'type', 'uri',
+              's', 'p', 'o', 'A']
+    report('searchObjects row',
+           per_row(object_rows(False), shared),
+           per_row(object_rows(True), shared))
+    before, extra = triple_rows(False)
+    after, extra = triple_rows(True)
+    report('searchTriples row',
+           per_row(before, shared + extra),
+           per_row(after, shared + extra))
+    before, extra = handles(DictObject, DictDatastream)
+    after, extra = handles(FedoraObject, FedoraDatastream)
+    report('object and datastream',
+           per_row(before, shared + extra),
+           per_row(after, shared + extra))
+
+if __name__ == '__main__':
+    main()
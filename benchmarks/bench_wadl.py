@@ -0,0 +1,113 @@
+# Copyright (c) 2010 Infrae / Technical University Delft. All rights reserved.
+# See also LICENSE.txt
+"""
+Micro-benchmark for the client side overhead of the WADL API.
+
+Compares the old implementation, which ran an XPath over the whole WADL
+document for every method when the API was created and for every request,
+with the compiled method table. No Fedora server is needed, requests are
+sent to a connection that does nothing.
+
+Run with: bin/py benchmarks/bench_wadl.py
+"""
+import timeit
+
+from lxml import etree
+
+from fcrepo.wadl import API, WADLRequest, NSMAP, PARAM_TYPES, compile_wadl
+
+def make_wadl(resources=40, params=12):
+    # roughly the size of the WADL of Fedora 3.4
+    methods = []
+    for i in range(resources):
+        request = ''.join(
+            '<param name="param%s" type="xs:string" style="query"/>' % j
+            for j in range(params))
+        methods.append('<resource path="resource%s">'
+                       '<method id="method%s" name="GET">'
+                       '<request>%s</request></method>'
+                       '</resource>' % (i, i, request))
+    return ('<application xmlns="%s"><resources base="http://localhost/">'
+            '<resource path="/objects"><resource path="{pid}">%s'
+            '</resource></resource></resources></application>' % (
+                NSMAP['wadl'], ''.join(methods)))
+
+class NullConnection(object):
+    url = 'http://localhost:8080/fedora'
+    form_headers = {'Authorization': 'Basic Zm9vOmJhcg=='}
+
+    def __init__(self, wadl_xml):
+        self.wadl_xml = wadl_xml
+
+    def open(self, url, body='', headers=None, method='GET',
+             operation=None):
+        return self
+
+    def read(self):
+        return self.wadl_xml
+
+    def close(self):
+        pass
+
+class XPathRequest(WADLRequest):
+    # the request as it was before the method table was compiled
+    def __init__(self, url, method):
+        self.url = url
+        self.method = method
+        self.headers = self.method.api.connection.form_headers.copy()
+        self.param_types = {}
+        self.undocumented_params = {}
+        self.default_values = {}
+        for param in self.method.api.doc.xpath(
+            '//wadl:method[@id="%s"]/wadl:request/wadl:param' % self.method.id,
+            namespaces=NSMAP):
+            name = param.attrib['name']
+            self.param_types[name] = PARAM_TYPES[param.attrib['type']]
+            default_value = param.attrib.get('default')
+            if default_value:
+                self.default_values[name] = default_value
+
+def xpath_compile(doc):
+    # the per method ancestor query used to build the API
+    for method in doc.xpath('//wadl:method', namespaces=NSMAP):
+        u'/'.join(doc.xpath(
+            '//wadl:method[@id="%s"]//ancestor::wadl:resource/@path' % (
+                method.attrib['id']), namespaces=NSMAP))
+
+def report(name, before, after, number):
+    print '%-28s %10.1f us %10.1f us %6.1fx' % (
+        name, before / number * 1e6, after / number * 1e6, before / after)
+
+def main():
+    wadl_xml = make_wadl()
+    connection = NullConnection(wadl_xml)
+    api = API(connection)
+    api.doc = etree.fromstring(wadl_xml)
+    method = api.method20
+
+    print '%-28s %13s %13s %7s' % ('', 'before', 'after', '')
+    number = 20
+    before = timeit.timeit(lambda: xpath_compile(etree.fromstring(wadl_xml)),
+                           number=number)
+    after = timeit.timeit(lambda: compile_wadl(wadl_xml), number=number)
+    report('compile WADL', before, after, number)
+    table = api.table
+    after = timeit.timeit(lambda: API(connection, table), number=number)
+    report('create API from table', before, after, number)
+
+    number = 2000
+    url = method.url % {'pid': u'foo:1'}
+    before = timeit.timeit(lambda: XPathRequest(url, method), number=number)
+    after = timeit.timeit(lambda: method(pid=u'foo:1'), number=number)
+    report('create request', before, after, number)
+
+    before = timeit.timeit(
+        lambda: XPathRequest(url, method).submit(param1=u'x', param2=u'y'),
+        number=number)
+    after = timeit.timeit(
+        lambda: method(pid=u'foo:1').submit(param1=u'x', param2=u'y'),
+        number=number)
+    report('create and submit request', before, after, number)
+
+if __name__ == '__main__':
+    main()
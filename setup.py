@@ -29,6 +29,9 @@ setup(
     'console_scripts': [
         'install_fedora = fcrepo.scripts:install_fedora',
         'start_fedora = fcrepo.scripts:start_fedora',
+        'compile_wadl = fcrepo.scripts:compile_wadl',
+        'bulk_ingest = fcrepo.scripts:bulk_ingest',
+        'bulk_export = fcrepo.scripts:bulk_export',
       ]
     },
     install_requires=[
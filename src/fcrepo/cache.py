@@ -0,0 +1,301 @@
+# Copyright (c) 2010 Infrae / Technical University Delft. All rights reserved.
+# See also LICENSE.txt
+
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+from time import time
+from collections import OrderedDict
+
+class LRUCache(object):
+    """
+    A thread-safe cache holding at most maxsize values, each for at most
+    ttl seconds. When it's full the least recently used value is dropped.
+    A cache can be shared by several clients.
+    """
+    def __init__(self, maxsize=1000, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, None)
+            if item is None or item[1] < time():
+                self.misses += 1
+                return default
+            # move it to the end, as the most recently used
+            self._data[key] = item
+            self.hits += 1
+            return item[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, time() + self.ttl)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def discard(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def discard_if(self, predicate):
+        """ Removes all values for which predicate(key) is true """
+        with self._lock:
+            for key in [key for key in self._data if predicate(key)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._data),
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions}
+
+
+class ContentCache(object):
+    """
+    Keeps datastream content in directory, so content that didn't change
+    isn't downloaded again.
+
+    Content is stored once per SHA-1 of the bytes, no matter how many
+    datastreams have it. For every datastream, known by the url of its
+    server, pid and dsid, the version it was fetched at is recorded, and a
+    cached copy is only used while the versionId, createdDate, checksum and
+    size in the datastream profile match. When the content takes more than
+    max_size bytes, the least recently read content is removed.
+
+    Only managed and inline content is cached, the content of external
+    and redirect datastreams can change without Fedora knowing.
+    """
+    def __init__(self, directory, max_size=1024**3):
+        self.directory = directory
+        self.max_size = max_size
+        self._blobs = os.path.join(directory, 'blobs')
+        self._keys = os.path.join(directory, 'keys')
+        self._tmp = os.path.join(directory, 'tmp')
+        for path in (self._blobs, self._keys, self._tmp):
+            if not os.path.isdir(path):
+                os.makedirs(path)
+        self._lock = threading.Lock()
+        self.size = sum(size for path, size, used in self._list_blobs())
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def cacheable(self, profile):
+        return profile.get('controlGroup') in ('M', 'X')
+
+    def _key_path(self, url, pid, dsid):
+        key = ('%s/%s/%s' % (url, pid, dsid)).encode('utf8')
+        return os.path.join(self._keys, hashlib.sha1(key).hexdigest())
+
+    def _blob_path(self, digest):
+        return os.path.join(self._blobs, digest[:2], digest)
+
+    def _validator(self, profile):
+        return [profile.get(name) for name in
+                ('versionId', 'createdDate', 'checksum', 'size')]
+
+    def open(self, url, pid, dsid, profile):
+        """
+        Returns the cached content as a CachedResponse, read like the
+        response of a request, or None when it isn't cached for the
+        version described by profile.
+        """
+        try:
+            fp = open(self._key_path(url, pid, dsid))
+            try:
+                entry = json.load(fp)
+            finally:
+                fp.close()
+            if entry['validator'] != self._validator(profile):
+                raise KeyError(pid, dsid)
+            path = self._blob_path(entry['blob'])
+            content = open(path, 'rb')
+        except (IOError, OSError, ValueError, KeyError):
+            with self._lock:
+                self.misses += 1
+            return None
+        # the modification time tells which content was used last
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return CachedResponse(content, profile)
+
+    def wrap(self, url, pid, dsid, profile, response):
+        """
+        Returns a reader for response that stores the content while it's
+        read. The content is added once it has been read completely.
+        """
+        return CachingReader(self, url, pid, dsid, profile, response)
+
+    def _store(self, url, pid, dsid, profile, tmp, digest, size):
+        path = self._blob_path(digest)
+        with self._lock:
+            if os.path.exists(path):
+                os.remove(tmp)
+            else:
+                if not os.path.isdir(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                os.rename(tmp, path)
+                self.size += size
+            fd, tmp = tempfile.mkstemp(dir=self._tmp)
+            fp = os.fdopen(fd, 'w')
+            json.dump({'validator': self._validator(profile),
+                       'blob': digest}, fp)
+            fp.close()
+            os.rename(tmp, self._key_path(url, pid, dsid))
+            if self.size > self.max_size:
+                self._evict()
+
+    def _list_blobs(self):
+        for dirpath, dirnames, filenames in os.walk(self._blobs):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield path, stat.st_size, stat.st_mtime
+
+    def _evict(self):
+        # remove down to 90% so not every new blob causes a scan
+        blobs = sorted(self._list_blobs(), key=lambda blob: blob[2])
+        for path, size, used in blobs:
+            if self.size <= self.max_size * 0.9:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.size -= size
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            for path in (self._blobs, self._keys):
+                shutil.rmtree(path)
+                os.makedirs(path)
+            self.size = 0
+
+    def stats(self):
+        with self._lock:
+            return {'size': self.size,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions}
+
+
+class CachedResponse(object):
+    """ Cached content, read like a httplib response """
+    status = 200
+    reason = 'OK'
+
+    def __init__(self, fp, profile):
+        self._fp = fp
+        self.length = os.fstat(fp.fileno()).st_size
+        self.msg = {'content-length': str(self.length)}
+        if profile.get('mimeType'):
+            self.msg['content-type'] = profile['mimeType'].encode('utf8')
+
+    def read(self, amt=None):
+        if self._fp is None:
+            return ''
+        if amt is None:
+            data = self._fp.read()
+        else:
+            data = self._fp.read(amt)
+        self.length -= len(data)
+        if not data or not self.length:
+            self.close()
+        return data
+
+    def readinto(self, buffer):
+        if self._fp is None:
+            return 0
+        count = self._fp.readinto(buffer)
+        self.length -= count
+        if not count or not self.length:
+            self.close()
+        return count
+
+    def getheader(self, name, default=None):
+        return self.msg.get(name.lower(), default)
+
+    def getheaders(self):
+        return self.msg.items()
+
+    def isclosed(self):
+        return self._fp is None
+
+    def close(self):
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+
+
+class CachingReader(object):
+    """ Reads a response while writing its content to a ContentCache """
+    def __init__(self, cache, url, pid, dsid, profile, response):
+        self._cache = cache
+        self._key = (url, pid, dsid, profile)
+        self._response = response
+        fd, self._tmp = tempfile.mkstemp(dir=cache._tmp)
+        self._fp = os.fdopen(fd, 'wb')
+        self._hash = hashlib.sha1()
+        self._size = 0
+
+    def read(self, amt=None):
+        if amt is None:
+            data = self._response.read()
+        else:
+            data = self._response.read(amt)
+        if self._fp is not None:
+            if data:
+                self._fp.write(data)
+                self._hash.update(data)
+                self._size += len(data)
+            if not data or amt is None:
+                self._fp.close()
+                self._fp = None
+                url, pid, dsid, profile = self._key
+                self._cache._store(url, pid, dsid, profile, self._tmp,
+                                   self._hash.hexdigest(), self._size)
+        return data
+
+    def close(self):
+        if self._fp is not None:
+            # not read completely, so there is nothing to store
+            self._fp.close()
+            self._fp = None
+            os.remove(self._tmp)
+        self._response.close()
+
+    def __del__(self):
+        if self.__dict__.get('_fp') is not None:
+            self._fp.close()
+            os.remove(self._tmp)
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
@@ -1,8 +1,10 @@
 # Copyright (c) 2010 Infrae / Technical University Delft. All rights reserved.
 # See also LICENSE.txt
 
+import re
+import csv
 import urllib
-from collections import defaultdict
+from collections import defaultdict, namedtuple, deque
 
 from copy import copy
 
@@ -10,14 +12,81 @@ from lxml import etree
 from lxml.builder import ElementMaker
 
 from fcrepo.wadl import API
-from fcrepo.utils import NS
+from fcrepo.utils import (NS, CHECKSUM_ALGORITHMS, ChecksumReader,
+                          rdfxml2dict)
 from fcrepo.object import FedoraObject
+from fcrepo.connection import APIException, iter_lines
+from fcrepo.concurrency import WorkerPool, Result, iterate_ahead
 
 NSMAP = {'foxml': 'info:fedora/fedora-system:def/foxml#'}
 
+# escapes in N-Triples literals
+NTRIPLES_ESCAPE = re.compile(
+    r'\\(?:([tbnrf"\'\\])|u([0-9A-Fa-f]{4})|U([0-9A-Fa-f]{8}))')
+NTRIPLES_CHARS = {'t': u'\t', 'b': u'\b', 'n': u'\n', 'r': u'\r', 'f': u'\f',
+                  '"': u'"', "'": u"'", '\\': u'\\'}
+
+def _ntriples_unescape(match):
+    char, short, long = match.groups()
+    if char:
+        return NTRIPLES_CHARS[char]
+    # decoded this way a long escape works on narrow unicode builds too
+    return (u'\\u%s' % short if short else
+            u'\\U%s' % long).encode('ascii').decode('unicode_escape')
+
+# searchObjects fields holding object profile properties
+PROFILE_FIELDS = {'label': 'label',
+                  'ownerId': 'ownerId',
+                  'state': 'state',
+                  'cDate': 'createdDate',
+                  'mDate': 'lastModifiedDate'}
+
 class FedoraClient(object):
-    def __init__(self, connection):
-        self.api = API(connection)
+    def __init__(self, connection, wadl_table=None, wadl_cache_dir=None,
+                 cache=None, content_cache=None, graph=None,
+                 wadl_cache_max_age=86400):
+        """
+        cache -- An optional fcrepo.cache.LRUCache for object profiles,
+                datastream lists and datastream profiles. Writes made
+                through this client remove the affected entries.
+
+        content_cache -- An optional fcrepo.cache.ContentCache, which keeps
+                datastream content on disk. Content is only downloaded when
+                the datastream profile shows that it changed.
+
+        graph -- An optional fcrepo.graph.TripleIndex, which is kept up to
+                date with the RELS-EXT datastreams read and written through
+                this client.
+        """
+        self.api = API(connection, wadl_table, wadl_cache_dir,
+                       wadl_cache_max_age)
+        self.cache = cache
+        self.content_cache = content_cache
+        self.graph = graph
+
+    def _cache_key(self, key):
+        # a cache may be shared by clients of different servers
+        return (key[0], self.api.connection.url) + key[1:]
+
+    def _cache_get(self, key):
+        if self.cache is None:
+            return None
+        value = self.cache.get(self._cache_key(key))
+        if value is not None:
+            # callers may modify what they get
+            value = copy(value)
+        return value
+
+    def _cache_set(self, key, value):
+        if self.cache is not None:
+            self.cache.set(self._cache_key(key), copy(value))
+
+    def _invalidate(self, pid, dsid=None):
+        if self.cache is None:
+            return
+        self.cache.discard(self._cache_key(('profile', pid)),
+                           self._cache_key(('datastreams', pid)),
+                           self._cache_key(('datastream', pid, dsid)))
 
     def getNextPID(self, namespace, numPIDs=1, format=u'text/xml'):
         request = self.api.getNextPID()
@@ -42,6 +111,11 @@ class FedoraClient(object):
         return ids
 
     def createObject(self, pid, label, state=u'A'):
+        self.ingestObject(pid, label, state)
+        return self.getObject(pid)
+
+    def ingestObject(self, pid, label, state=u'A'):
+        """ Like createObject, without fetching the new object """
         foxml = ElementMaker(namespace=NSMAP['foxml'], nsmap=NSMAP)
         foxml_state = {'A': u'Active',
                        'I': u'Inactive',
@@ -59,12 +133,80 @@ class FedoraClient(object):
         request = self.api.createObject(pid=pid)
         request.headers['Content-Type'] = 'text/xml; charset=utf-8'
         response = request.submit(body, state=state[0], label=label)
-        return self.getObject(pid)
+        response.read()
+        response.close()
+        return pid
     
     def getObject(self, pid):
         return FedoraObject(pid, self)
 
+    def getObjects(self, pids, datastreams=(), content=False, workers=10):
+        """
+        Yields a Result for every PID, in the order of the PIDs, with
+        the FedoraObject as its object. Their profiles, datastream lists and the
+        profiles of the given datastreams are fetched at the same time by
+        a pool of worker threads, or one after the other when the
+        connection isn't pooled. With content, the properties and
+        relations of the DC and RELS-EXT datastreams are loaded too.
+
+        Datastreams an object doesn't have are left out. When a PID fails
+        its result has the error, the other PIDs are not affected. PIDs
+        are read lazily, at most workers objects are fetched ahead.
+        """
+        if self.api.connection.pool is None:
+            workers = 0
+        datastreams = list(datastreams)
+        pool = WorkerPool(workers)
+        pending = deque()
+        try:
+            for pid in pids:
+                dsids = pool.submit(self.listDatastreams, pid)
+                profile = pool.submit(self.getObjectProfile, pid)
+                # queued after the list, which is fetched when they start
+                futures = [(dsid, pool.submit(self._datastream_data, pid,
+                                              dsid, dsids, content and dsid
+                                              in ('DC', 'RELS-EXT')))
+                           for dsid in datastreams]
+                pending.append((pid, profile, dsids, futures))
+                if len(pending) > workers:
+                    yield self._hydrated(*pending.popleft())
+            while pending:
+                yield self._hydrated(*pending.popleft())
+        finally:
+            pool.shutdown()
+
+    def _datastream_data(self, pid, dsid, dsids, content):
+        if dsid not in dsids.result():
+            return None, None
+        profile = self.getDatastreamProfile(pid, dsid)
+        if not content:
+            return profile, None
+        response = self.getDatastream(pid, dsid, profile)
+        try:
+            return profile, response.read()
+        finally:
+            response.close()
+
+    def _hydrated(self, pid, profile, dsids, datastreams):
+        try:
+            obj = FedoraObject(pid, self, profile.result())
+            obj._dsids = dsids.result()
+            for dsid, future in datastreams:
+                ds_profile, data = future.result()
+                if ds_profile is None:
+                    continue
+                ds = obj[dsid]
+                ds._info = ds_profile
+                if data is not None:
+                    ds._load(data)
+        except Exception, e:
+            return Result(pid, error=e, object=None)
+        return Result(pid, object=obj)
+
     def getObjectProfile(self, pid):
+        result = self._cache_get(('profile', pid))
+        if result is not None:
+            return result
         request = self.api.getObjectProfile(pid=pid)
         response = request.submit(format=u'text/xml')
         xml = response.read()
@@ -86,23 +228,39 @@ class FedoraClient(object):
             if not isinstance(value, unicode):
                 value = value.decode('utf8')
             result[name] = value
+        self._cache_set(('profile', pid), result)
         return result
 
     def updateObject(self, pid, body='', **params):
         request = self.api.updateObject(pid=pid)
         response = request.submit(body, **params)
+        response.read()
+        response.close()
+        self._invalidate(pid)
 
     def deleteObject(self, pid, **params):
         request = self.api.deleteObject(pid=pid)
         response = request.submit(**params)
+        response.read()
+        response.close()
+        if self.cache is not None:
+            url = self.api.connection.url
+            self.cache.discard_if(lambda key: key[1:3] == (url, pid))
+        if self.graph is not None:
+            self.graph.remove_subject(u'info:fedora/%s' % pid)
         
     def listDatastreams(self, pid):
+        dsids = self._cache_get(('datastreams', pid))
+        if dsids is not None:
+            return dsids
         request = self.api.listDatastreams(pid=pid)
         response = request.submit(format=u'text/xml')
         xml = response.read()
         response.close()
         doc = etree.fromstring(xml)
-        return [child.attrib['dsid'] for child in doc]
+        dsids = [child.attrib['dsid'] for child in doc]
+        self._cache_set(('datastreams', pid), dsids)
+        return dsids
 
     def addDatastream(self, pid, dsid, body='', **params):
         if dsid == 'RELS-EXT' and not body:
@@ -121,10 +279,67 @@ class FedoraClient(object):
             params['checksumType'] = u'MD5'
 
         params = self._fix_ds_params(params)
+        body, reader = self._checksum_body(body, params,
+                                           params.get('controlGroup', u'X'))
 
         request = self.api.addDatastream(pid=pid, dsID=dsid)
         request.headers['Content-Type'] = params['mimeType']
-        response = request.submit(body, **params)        
+        response = request.submit(body, **params)
+        xml = response.read()
+        response.close()
+        profile = self._written_profile(pid, dsid, xml)
+        self._verify_checksum(pid, dsid, profile, reader)
+        if self.graph is not None and dsid == 'RELS-EXT' and body:
+            self._index_relsext(pid, body)
+        return profile
+
+    def _checksum_body(self, body, params, control_group=None):
+        # Streamed content is checksummed while it is sent, so it can be
+        # verified against the checksum Fedora computed without reading
+        # the stream twice. Only managed content is stored as it was
+        # sent, Fedora serializes inline XML again.
+        if (isinstance(body, basestring) or 'checksum' in params or
+            params.get('checksumType') not in CHECKSUM_ALGORITHMS or
+            control_group not in (None, u'M')):
+            return body, None
+        reader = ChecksumReader(body, params['checksumType'])
+        return reader, reader
+
+    def _index_relsext(self, pid, body):
+        subject = u'info:fedora/%s' % pid
+        if isinstance(body, basestring):
+            try:
+                self.graph.set_subject(subject, rdfxml2dict(body))
+                return
+            except (ValueError, etree.XMLSyntaxError):
+                pass
+        # we don't know what was written
+        self.graph.remove_subject(subject)
+
+    def _written_profile(self, pid, dsid, xml):
+        # Fedora returns the new datastream profile after a write, which
+        # saves fetching it again. Older versions return nothing useful.
+        self._invalidate(pid, dsid)
+        try:
+            profile = self._parse_datastream_profile(xml)
+        except etree.XMLSyntaxError:
+            return None
+        if not profile:
+            return None
+        self._cache_set(('datastream', pid, dsid), profile)
+        return profile
+
+    def _verify_checksum(self, pid, dsid, profile, reader):
+        if (reader is None or profile is None or
+            profile.get('controlGroup') != 'M'):
+            return
+        checksum = profile.get('checksum')
+        if not checksum or checksum == 'none':
+            return
+        if checksum.lower() != reader.hexdigest():
+            raise APIException(
+                'Checksum mismatch on %s/%s: sent %s, Fedora stored %s' % (
+                    pid, dsid, reader.hexdigest(), checksum))
 
     def _fix_ds_params(self, params):
         for name, param in params.items():
@@ -138,15 +353,23 @@ class FedoraClient(object):
         return params
         
     def getDatastreamProfile(self, pid, dsid):
+        result = self._cache_get(('datastream', pid, dsid))
+        if result is not None:
+            return result
         request = self.api.getDatastreamProfile(pid=pid, dsID=dsid)
         response = request.submit(format=u'text/xml')
         xml = response.read()
         response.close()
+        result = self._parse_datastream_profile(xml)
+        self._cache_set(('datastream', pid, dsid), result)
+        return result
+
+    def _parse_datastream_profile(self, xml):
         doc = etree.fromstring(xml)
         result = {}
         tags = {
             'dsLabel': 'label',
-            'dsVerionId': 'versionId',
+            'dsVersionID': 'versionId',
             'dsCreateDate': 'createdDate',
             'dsState': 'state',
             'dsMIME': 'mimeType',
@@ -175,16 +398,63 @@ class FedoraClient(object):
 
     def modifyDatastream(self, pid, dsid, body='', **params):
         params = self._fix_ds_params(params)
+        # the control group of an existing datastream shows in its profile
+        body, reader = self._checksum_body(body, params,
+                                           params.get('controlGroup'))
         request = self.api.modifyDatastream(pid=pid, dsID=dsid)
         response = request.submit(body, **params)
+        xml = response.read()
+        response.close()
+        profile = self._written_profile(pid, dsid, xml)
+        self._verify_checksum(pid, dsid, profile, reader)
+        if self.graph is not None and dsid == 'RELS-EXT' and body:
+            self._index_relsext(pid, body)
+        return profile
         
-    def getDatastream(self, pid, dsid):
+    def getDatastream(self, pid, dsid, profile=None):
+        """
+        Returns the content of a datastream as a response to read from.
+        With a content cache, the content may come from a file instead;
+        profile saves fetching the datastream profile to check it.
+        """
+        if self.content_cache is not None:
+            if profile is None:
+                profile = self.getDatastreamProfile(pid, dsid)
+            if self.content_cache.cacheable(profile):
+                url = self.api.connection.url
+                content = self.content_cache.open(url, pid, dsid, profile)
+                if content is not None:
+                    return content
+                request = self.api.getDatastream(pid=pid, dsID=dsid)
+                return self.content_cache.wrap(url, pid, dsid, profile,
+                                               request.submit())
         request = self.api.getDatastream(pid=pid, dsID=dsid)
         return request.submit()
 
+    def export(self, pid, format=u'info:fedora/fedora-system:FOXML-1.1',
+               context=u'public', **params):
+        """
+        Returns the serialization of an object in format as a response
+        to read from. The context is public, migrate or archive, the
+        latter including the content of managed datastreams.
+        """
+        request = self.api.export(pid=pid)
+        return request.submit(format=format, context=context, **params)
+
+    def getObjectXML(self, pid):
+        """ Returns the FOXML of an object as stored, as a response """
+        request = self.api.getObjectXML(pid=pid)
+        return request.submit()
+
     def deleteDatastream(self, pid, dsid, **params):
         request = self.api.deleteDatastream(pid=pid, dsID=dsid)
-        return request.submit(**params)
+        response = request.submit(**params)
+        # a persistent connection can't be used again until it's read
+        response.read()
+        response.close()
+        self._invalidate(pid, dsid)
+        if self.graph is not None and dsid == 'RELS-EXT':
+            self.graph.remove_subject(u'info:fedora/%s' % pid)
 
     def getAllObjectMethods(self, pid, **params):
         params['format'] = u'text/xml'
@@ -207,66 +477,153 @@ class FedoraClient(object):
         return request.submit(**params)
 
         
-    def searchObjects(self, query, fields, terms=False, maxResults=10):
-        field_params = {}
+    def searchObjects(self, query, fields, terms=False, maxResults=10,
+                      prefetch=1, compact=False, objects=False):
+        """
+        Yields a dictionary of field values for every object found. The
+        result pages are parsed while they are read. On a pooled connection
+        up to prefetch pages of results are fetched ahead by a background
+        thread while the caller handles the current page.
+
+        With compact, named tuples are yielded instead, with a tuple of
+        values for each of the fields. They take far less memory.
+
+        With objects, a FedoraObject is yielded for every object, with the
+        properties in the fields (label, ownerId, state, cDate and mDate)
+        taken from the results. The object profile is only fetched when
+        another property is used. The pid field is always included.
+        """
         assert isinstance(fields, list)
+        if objects:
+            if 'pid' not in fields:
+                fields = ['pid'] + fields
+            compact = False
+        results = self._searchObjects(query, fields, terms, maxResults,
+                                      compact)
+        if objects:
+            results = (self._found_object(data) for data in results)
+        if prefetch and self.api.connection.pool is not None:
+            results = iterate_ahead(results, prefetch * maxResults)
+        for result in results:
+            yield result
+
+    def _found_object(self, data):
+        info = {}
+        for field, name in PROFILE_FIELDS.items():
+            if data.get(field):
+                info[name] = data[field][0]
+        return FedoraObject(data['pid'][0], self, info, partial=True)
+
+    def _searchObjects(self, query, fields, terms, maxResults, compact):
+        if compact:
+            row_type = namedtuple('ObjectFields', fields, rename=True)
+        field_params = {}
         for field in fields:
             field_params[field] = u'true'
             
+        params = {'maxResults': maxResults,
+                  'resultFormat': u'text/xml'}
+        if terms:
+            params['terms'] = query
+        else:
+            params['query'] = query
+
         token = True
-        NS = 'http://www.fedora.info/definitions/1/0/types/'
         while token:
-            if token is True:
-                token = False
+            if token is not True:
+                params['sessionToken'] = token
+            token = False
             request = self.api.searchObjects()
             request.undocumented_params = field_params
+            response = request.submit(**params)
+            try:
+                for event, el in etree.iterparse(response):
+                    name = el.tag.rpartition('}')[2]
+                    if name == 'token':
+                        token = el.text.decode('utf8')
+                    elif name == 'objectFields':
+                        data = defaultdict(list)
+                        for child in el:
+                            field_name = child.tag.split('}')[-1].decode('utf8')
+                            value = child.text or u''
+                            if not isinstance(value, unicode):
+                                value = value.decode('utf8')
+                            data[field_name].append(value)
+                        # free the parsed results as we go
+                        el.clear()
+                        while el.getprevious() is not None:
+                            del el.getparent()[0]
+                        if compact:
+                            yield row_type._make(tuple(data.get(field, ()))
+                                                 for field in fields)
+                        else:
+                            yield data
+            finally:
+                response.close()
 
-            if token:
-                if terms:
-                    response = request.submit(terms=query,
-                                              sessionToken=token,
-                                              maxResults=maxResults,
-                                              resultFormat=u'text/xml')
-                else:
-                    response = request.submit(query=query,
-                                              sessionToken=token,
-                                              maxResults=maxResults,
-                                              resultFormat=u'text/xml')
-            else:
-                if terms:
-                    response = request.submit(terms=query,
-                                              maxResults=maxResults,
-                                              resultFormat=u'text/xml')
-                else:
-                    response = request.submit(query=query,
-                                              maxResults=maxResults,
-                                              resultFormat=u'text/xml')
+    def searchTriples(self, query, lang='sparql', format='Sparql',
+                      limit=100, type='tuples', dt='on', flush=True,
+                      page_size=None, compact=False):
+        """
+        Yields the results of a resource index query, parsing the response
+        while it is read.
 
-            xml = response.read()
-            response.close()
-            doc = etree.fromstring(xml)
-                
-            tokens = doc.xpath('//f:token/text()', namespaces={'f': NS})
-            if tokens:
-                token = tokens[0].decode('utf8')
-            else:
-                token = False
-            
-            for result in doc.xpath('//f:objectFields', namespaces={'f': NS}):
-                data = defaultdict(list)
+        format -- 'Sparql' yields a dictionary per row, mapping the names to
+                dictionaries with the value and its type. The 'CSV' and 'TSV'
+                formats are cheaper to produce and parse, they yield
+                dictionaries mapping the names to the values.
 
-                for child in result:
-                    field_name = child.tag.split('}')[-1].decode('utf8')
-                    value = child.text or u''
-                    if not isinstance(value, unicode):
-                        value = value.decode('utf8')
-                    data[field_name].append(value)
-                yield data
+        limit -- The maximum number of rows, None for no maximum.
 
-                
-    def searchTriples(self, query, lang='sparql', format='Sparql',
-                      limit=100, type='tuples', dt='on', flush=True):
-        
+        page_size -- Fetch the results in pages of this many rows, by adding
+                LIMIT and OFFSET to the query. The query needs an ORDER BY
+                for the pages to be consistent.
+
+        compact -- Yield named tuples of the values, in the order of the
+                names in the query, instead of dictionaries.
+        """
+        parsers = {'sparql': self._parse_sparql,
+                   'csv': self._parse_csv,
+                   'tsv': self._parse_tsv}
+        parser = parsers.get(format.lower())
+        if parser is None:
+            raise APIException('Unsupported result format: %s' % format)
+        offset = 0
+        while True:
+            page_query = query
+            page_limit = limit
+            if page_size:
+                page_limit = page_size
+                if limit:
+                    page_limit = min(page_size, limit - offset)
+                page_query = query + ' limit %d offset %d' % (page_limit,
+                                                             offset)
+            response = self._risearch(page_query, lang, format, page_limit,
+                                      type, dt, flush)
+            count = 0
+            try:
+                for row in parser(response, compact):
+                    count += 1
+                    yield row
+            finally:
+                response.close()
+            offset += count
+            if not page_size or count < page_limit:
+                break
+            if limit and offset >= limit:
+                break
+            # the first page already brought the triplestore up to date
+            flush = False
+
+    def countTriples(self, query, lang='sparql', type='tuples', flush=True):
+        """ Returns the number of results of a resource index query """
+        response = self._risearch(query, lang, 'count', None, type, 'on',
+                                  flush)
+        count = response.read()
+        response.close()
+        return int(count.strip())
+
+    def _risearch(self, query, lang, format, limit, type, dt, flush):
         flush = str(flush).lower()
         URL_pramaters = {'query':query,
                    'lang':lang,
@@ -277,7 +634,7 @@ class FedoraClient(object):
         
         #conditionaly set limit if there is one. (so it can be set to None)
         if limit:
-            URL_pramaters['limit'] = limit
+            URL_pramaters['limit'] = unicode(limit)
         
         # Encode in utf8 to let unicode pass through urlencode
         for key in URL_pramaters:
@@ -286,34 +643,89 @@ class FedoraClient(object):
         url = u'/risearch?%s' % urllib.urlencode(URL_pramaters)
         #Fedora started needing authentication in 3.5 for RI, tested in 3.4 as well
         headers = copy(self.api.connection.form_headers)
-        headers['Accept:'] = 'text/xml'
-        response = self.api.connection.open(url, '', headers, method='POST')
-        xml = response.read()
-        doc = etree.fromstring(xml)
-        NS = 'http://www.w3.org/2001/sw/DataAccess/rf1/result' # ouch, old!
-        for result in doc.xpath('//sparql:result', namespaces={'sparql': NS}):
-            data = {}
-            for el in result:
-                name = el.tag.split('}')[-1]
-                value = {}
-                uri = el.attrib.get('uri')
-                if uri:
-                    value['value'] = uri.decode('utf8')
-                    value['type'] = 'uri'
+        if format.lower() == 'sparql':
+            headers['Accept'] = 'text/xml'
+        return self.api.connection.open(url, '', headers, method='POST',
+                                        operation='risearch')
+
+    def _parse_sparql(self, response, compact):
+        # the results are in the old rf1 namespace, which is ignored here
+        names = []
+        row_type = namedtuple('Row', names)
+        for event, el in etree.iterparse(response):
+            name = el.tag.rpartition('}')[2]
+            parent = el.getparent()
+            if parent is None:
+                continue
+            parent_name = parent.tag.rpartition('}')[2]
+            if name == 'variable' and parent_name == 'head':
+                names.append(el.attrib['name'])
+                row_type = namedtuple('Row', names, rename=True)
+            elif name == 'result' and parent_name == 'results':
+                data = {}
+                for child in el:
+                    data[child.tag.split('}')[-1]] = self._sparql_value(child)
+                # free the parsed results as we go
+                el.clear()
+                while el.getprevious() is not None:
+                    del parent[0]
+                if compact:
+                    yield row_type._make(
+                        data[var]['value'] if var in data else None
+                        for var in names)
                 else:
-                    value['type'] = 'literal'
-                    if isinstance(el.text, unicode):
-                        value['value'] = el.text
-                    elif el.text:
-                        value['value'] = el.text.decode('utf8')
-                    else:
-                        value['value'] = u''
-                    datatype = el.attrib.get('datatype')
-                    lang = el.attrib.get('lang')
-                    if datatype:
-                        value['datatype'] = datatype
-                    elif lang:
-                        value['lang'] = lang
-                data[name] = value
-            yield data
+                    yield data
+
+    def _sparql_value(self, el):
+        value = {}
+        uri = el.attrib.get('uri')
+        if uri:
+            value['value'] = uri.decode('utf8')
+            value['type'] = 'uri'
+        else:
+            value['type'] = 'literal'
+            if isinstance(el.text, unicode):
+                value['value'] = el.text
+            elif el.text:
+                value['value'] = el.text.decode('utf8')
+            else:
+                value['value'] = u''
+            datatype = el.attrib.get('datatype')
+            lang = el.attrib.get('lang')
+            if datatype:
+                value['datatype'] = datatype
+            elif lang:
+                value['lang'] = lang
+        return value
+
+    def _parse_csv(self, response, compact):
+        reader = csv.reader(iter_lines(response))
+        return self._parse_rows(reader, compact, lambda value: value)
+
+    def _parse_tsv(self, response, compact):
+        # TSV values are in N-Triples notation: <uri> or "literal"@lang
+        def convert(value):
+            if value.startswith(u'<') and value.endswith(u'>'):
+                return value[1:-1]
+            if value.startswith(u'"'):
+                value = value[1:value.rindex(u'"')]
+                return NTRIPLES_ESCAPE.sub(_ntriples_unescape, value)
+            return value
+        reader = csv.reader(iter_lines(response), delimiter='\t',
+                            quoting=csv.QUOTE_NONE)
+        return self._parse_rows(reader, compact, convert)
+
+    def _parse_rows(self, reader, compact, convert):
+        names = None
+        for row in reader:
+            if not row:
+                continue
+            row = [convert(value.decode('utf8')) for value in row]
+            if names is None:
+                names = [name.lstrip('?') for name in row]
+                row_type = namedtuple('Row', names, rename=True)
+            elif compact:
+                yield row_type._make(row)
+            else:
+                yield dict(zip(names, row))
         
@@ -0,0 +1,286 @@
+# Copyright (c) 2010 Infrae / Technical University Delft. All rights reserved.
+# See also LICENSE.txt
+
+import sys
+import Queue
+import logging
+import threading
+from time import time
+from collections import deque
+
+from fcrepo.connection import APIException
+
+class Future(object):
+    """ The result of a call that runs in a worker thread """
+    def __init__(self):
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+
+    def set_result(self, result):
+        self._result = result
+        self._finish()
+
+    def set_exception(self, exc_info):
+        self._exc_info = exc_info
+        self._finish()
+
+    def _finish(self):
+        with self._lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+    def add_done_callback(self, callback):
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def done(self):
+        return self._done.is_set()
+
+    def exception(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise APIException('Timed out waiting for a result')
+        if self._exc_info is not None:
+            return self._exc_info[1]
+
+    def result(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise APIException('Timed out waiting for a result')
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+
+class Result(object):
+    """
+    The outcome of a bulk operation for one object: its PID, the error
+    if it failed, whether it was skipped, the number of bytes moved, and
+    the other values given as keywords.
+    """
+    def __init__(self, pid, error=None, skipped=False, bytes=0, **values):
+        self.pid = pid
+        self.error = error
+        self.skipped = skipped
+        self.bytes = bytes
+        for name, value in values.items():
+            setattr(self, name, value)
+
+    def __repr__(self):
+        if self.error is not None:
+            return '<Result %s failed: %r>' % (self.pid, self.error)
+        return '<Result %s>' % self.pid
+
+
+class WorkerPool(object):
+    """
+    A fixed number of worker threads taking calls from a bounded queue.
+    Submitting blocks while the queue is full, so a fast producer can't
+    get ahead of the workers. Without workers the calls are made right
+    away by submit.
+    """
+    def __init__(self, workers=10, queue_size=None):
+        self.workers = workers
+        self._queue = Queue.Queue(queue_size or workers * 2)
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            future, func, args, kwargs = item
+            try:
+                future.set_result(func(*args, **kwargs))
+            except Exception:
+                future.set_exception(sys.exc_info())
+            item = future = None
+
+    def submit(self, func, *args, **kwargs):
+        future = Future()
+        if not self.workers:
+            try:
+                future.set_result(func(*args, **kwargs))
+            except Exception:
+                future.set_exception(sys.exc_info())
+            return future
+        self._queue.put((future, func, args, kwargs))
+        return future
+
+    def map_futures(self, func, iterable, window=None):
+        """
+        Calls func for every item and yields the futures in the order of
+        the items, once they are done. At most window calls are pending
+        at the same time, the iterable is consumed lazily.
+        """
+        window = window or self.workers * 2
+        pending = deque()
+        for item in iterable:
+            pending.append(self.submit(func, item))
+            if len(pending) >= window:
+                future = pending.popleft()
+                future.exception()
+                yield future
+        while pending:
+            future = pending.popleft()
+            future.exception()
+            yield future
+
+    def shutdown(self, wait=True):
+        for thread in self._threads:
+            self._queue.put(None)
+        if wait:
+            for thread in self._threads:
+                thread.join()
+        self._threads = []
+
+
+class ThroughputMeter(object):
+    """
+    Thread-safe counter of processed items and bytes, which reports the
+    rates every interval seconds to reporter, a callable taking the
+    statistics as a dictionary. By default the rates are logged.
+    """
+    def __init__(self, interval=10, reporter=None, name='throughput'):
+        self.interval = interval
+        self.reporter = reporter or self._log
+        self.name = name
+        self._lock = threading.Lock()
+        self.started = time()
+        self._reported = self.started
+        self.items = 0
+        self.bytes = 0
+        self.errors = 0
+
+    def add(self, items=1, bytes=0, errors=0):
+        with self._lock:
+            self.items += items
+            self.bytes += bytes
+            self.errors += errors
+            now = time()
+            due = self.interval and now - self._reported >= self.interval
+            if due:
+                self._reported = now
+        if due:
+            self.report()
+
+    def stats(self):
+        with self._lock:
+            elapsed = max(time() - self.started, 1e-6)
+            return {'items': self.items,
+                    'bytes': self.bytes,
+                    'errors': self.errors,
+                    'elapsed': elapsed,
+                    'items_per_sec': self.items / elapsed,
+                    'mb_per_sec': self.bytes / elapsed / 1024 ** 2}
+
+    def report(self):
+        self.reporter(self.stats())
+
+    def _log(self, stats):
+        logging.info('%s: %s done, %s failed, %.1f/s, %.2f MB/s',
+                     self.name, stats['items'], stats['errors'],
+                     stats['items_per_sec'], stats['mb_per_sec'])
+
+
+_END = object()
+
+def iterate_ahead(iterable, buffer=100):
+    """
+    Consumes iterable in a background thread, keeping up to buffer items
+    ready for the caller. Errors are raised in the calling thread.
+    """
+    queue = Queue.Queue(buffer)
+    stopped = threading.Event()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+        except Exception:
+            put((_END, sys.exc_info()))
+        else:
+            put((_END, None))
+
+    thread = threading.Thread(target=produce)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            item, exc_info = queue.get()
+            if item is _END:
+                if exc_info is not None:
+                    raise exc_info[0], exc_info[1], exc_info[2]
+                break
+            yield item
+    finally:
+        # also stops the producer when the caller abandons the iterator
+        stopped.set()
+
+
+class ConcurrentFedoraClient(object):
+    """
+    Runs the calls of a FedoraClient on a pool of worker threads.
+
+    Every method of the client is available, but instead of waiting for
+    the result it returns a Future. The searchObjects and searchTriples
+    methods return iterators that are filled ahead of the caller by a
+    background thread.
+
+    The connection of the client must be pooled, preferably with at
+    least as many connections as there are workers.
+    """
+    def __init__(self, client, workers=10, queue_size=None, buffer=100):
+        if client.api.connection.pool is None:
+            raise APIException('Concurrent requests need a pooled '
+                               'connection, see the pool_size argument of '
+                               'Connection')
+        self.client = client
+        self.buffer = buffer
+        self.pool = WorkerPool(workers, queue_size)
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+        if not callable(method):
+            return method
+        def submit(*args, **kwargs):
+            return self.pool.submit(method, *args, **kwargs)
+        return submit
+
+    def searchObjects(self, *args, **kwargs):
+        # the client itself fetches pages ahead on a pooled connection
+        return self.client.searchObjects(*args, **kwargs)
+
+    def searchTriples(self, *args, **kwargs):
+        return iterate_ahead(self.client.searchTriples(*args, **kwargs),
+                             self.buffer)
+
+    def close(self):
+        self.pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -1,14 +1,44 @@
 # Copyright (c) 2010 Infrae / Technical University Delft. All rights reserved.
 # See also LICENSE.txt
-import StringIO, socket, httplib, urlparse, logging
-from time import sleep
+import StringIO, socket, httplib, urlparse, logging, threading, uuid, sys
+import ssl, zlib, errno
+from time import sleep, time
 from copy import copy
 
+from fcrepo.retry import RetryPolicy, CONNECTION_ERRORS
+
+CHUNK_SIZE = 64 * 1024
+
+# methods that can be sent again after the server may have handled them
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+
+# socket errors of a connection the server closed
+CLOSED_ERRNOS = (errno.ECONNRESET, errno.EPIPE, errno.ECONNABORTED)
+
+def closed_by_server(exception):
+    """
+    Whether exception means the server closed the connection without
+    answering, as it does with keep-alive connections that were idle too
+    long. A timeout while waiting for the answer is not such an error.
+    """
+    if isinstance(exception, httplib.BadStatusLine):
+        # the message differs between Python 2.7 releases
+        return (exception.line in ("''", '""') or
+                exception.line.startswith('No status line received'))
+    if isinstance(exception, socket.error):
+        return getattr(exception, 'errno', None) in CLOSED_ERRNOS
+    return False
+
 class APIException(Exception):
     """ An exception in the general usage of the API """
     pass
 
     
+class CircuitOpenException(APIException):
+    """ Raised without contacting Fedora while the circuit breaker is open """
+    pass
+
+
 class FedoraConnectionException(Exception):
     """ An exception thrown by Fedora connections """
     def __init__(self, httpcode, reason=None, body=None):
@@ -24,6 +54,373 @@ class FedoraConnectionException(Exception):
         return repr(self)
 
 
+class HTTPConnection(httplib.HTTPConnection):
+    """
+    A httplib connection with Nagle's algorithm disabled, so the body of
+    a streamed request isn't held back until the headers are acknowledged.
+    """
+    def connect(self):
+        httplib.HTTPConnection.connect(self)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+class HTTPSConnection(httplib.HTTPSConnection):
+    """
+    A httplib HTTPS connection with Nagle's algorithm disabled, which
+    offers the TLS session of the previous connection to the host so the
+    server can resume it, where the ssl module supports that.
+    """
+    def __init__(self, host, transport):
+        httplib.HTTPSConnection.__init__(self, host,
+                                         context=transport.context)
+        self.transport = transport
+
+    def connect(self):
+        httplib.HTTPConnection.connect(self)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        server_hostname = self._tunnel_host or self.host
+        options = {}
+        session = self.transport.sessions.get(server_hostname)
+        if session is not None:
+            options['session'] = session
+        self.sock = self._context.wrap_socket(
+            self.sock, server_hostname=server_hostname, **options)
+        self.transport.handshake(server_hostname, self.sock)
+
+
+class HTTPTransport(object):
+    """
+    Sends requests over httplib connections, the default transport of a
+    Connection. A transport makes connection objects with connect, which
+    need close and connect methods for reconnecting, and sends a request
+    on one of them with send, returning the response.
+
+    With compress set, gzip and deflate encoded responses are asked for
+    and decompressed while they are read.
+
+    For https urls the server certificate is checked against the system
+    CAs, or the ones in the ca_certs file, unless verify is false. The
+    client certificate is read from cert_file, with its key in key_file
+    or in cert_file as well. An ssl.SSLContext can be given instead.
+    TLS sessions are resumed on reconnects on Pythons that support it
+    (3.6 and later), handshakes counts the TLS handshakes and resumed
+    the ones that resumed a session.
+    """
+    def __init__(self, compress=True, ca_certs=None, cert_file=None,
+                 key_file=None, verify=True, context=None):
+        self.compress = compress
+        self.ca_certs = ca_certs
+        self.cert_file = cert_file
+        self.key_file = key_file
+        self.verify = verify
+        self._context = context
+        self.sessions = {}
+        self.handshakes = 0
+        self.resumed = 0
+        self._lock = threading.Lock()
+
+    @property
+    def context(self):
+        # made on first use, loading the CAs takes a while
+        with self._lock:
+            if self._context is None:
+                context = ssl.create_default_context(cafile=self.ca_certs)
+                if not self.verify:
+                    context.check_hostname = False
+                    context.verify_mode = ssl.CERT_NONE
+                if self.cert_file is not None:
+                    context.load_cert_chain(self.cert_file, self.key_file)
+                self._context = context
+            return self._context
+
+    def connect(self, scheme, host):
+        if scheme == 'https':
+            return HTTPSConnection(host, self)
+        return HTTPConnection(host)
+
+    def handshake(self, host, sock):
+        """ Counts a TLS handshake and keeps its session for reuse """
+        with self._lock:
+            self.handshakes += 1
+            if getattr(sock, 'session_reused', False):
+                self.resumed += 1
+            session = getattr(sock, 'session', None)
+            if session is not None:
+                self.sessions[host] = session
+
+    def send(self, conn, method, url, body, headers):
+        # httplib connections have a socket once they were used
+        reused = getattr(conn, 'sock', None) is not None
+        if self.compress and 'Accept-Encoding' not in headers:
+            headers['Accept-Encoding'] = 'gzip, deflate'
+        if isinstance(body, basestring):
+            # We can't have unicode characters floating around in the body.
+            conn.request(method, url, body, headers)
+        else:
+            send_stream(conn, method, url, body, headers)
+        try:
+            response = conn.getresponse()
+        except CONNECTION_ERRORS as e:
+            # the request went out, the server may have handled it, unless
+            # it had closed the kept alive connection already
+            e.request_sent = True
+            e.stale = reused and closed_by_server(e)
+            raise
+        encoding = (response.getheader('content-encoding') or '').lower()
+        if encoding in ('gzip', 'deflate'):
+            return DecompressingResponse(response, encoding)
+        return response
+
+
+class DecompressingResponse(object):
+    """
+    Decompresses a gzip or deflate encoded response while it's read, a
+    chunk at a time.
+    """
+    def __init__(self, response, encoding):
+        self._response = response
+        self._pending = ''
+        self._done = False
+        if encoding == 'gzip':
+            self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            self._decompressor = None
+
+    def _decompress(self, data):
+        if self._decompressor is None:
+            # deflate should be zlib wrapped, some servers send it raw
+            self._decompressor = zlib.decompressobj()
+            try:
+                return self._decompressor.decompress(data)
+            except zlib.error:
+                self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        return self._decompressor.decompress(data)
+
+    def _fill(self):
+        data = self._response.read(CHUNK_SIZE)
+        if data:
+            self._pending += self._decompress(data)
+        else:
+            self._done = True
+            if self._decompressor is not None:
+                self._pending += self._decompressor.flush()
+
+    def read(self, amt=None):
+        if amt is None:
+            chunks = [self._pending]
+            while not self._done:
+                self._pending = ''
+                self._fill()
+                chunks.append(self._pending)
+            self._pending = ''
+            return ''.join(chunks)
+        while not self._done and len(self._pending) < amt:
+            self._fill()
+        data, self._pending = self._pending[:amt], self._pending[amt:]
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+
+class MemoryTransport(object):
+    """
+    Passes requests to app in the same process instead of sending them
+    over the network, for tests and benchmarks. The app is called with
+    the HTTP method, the url, the request headers with lower case names
+    and the body as a string, and returns the status, the response
+    headers and the body, see fcrepo.testing.FedoraApp.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    def connect(self, scheme, host):
+        return MemoryConnection()
+
+    def send(self, conn, method, url, body, headers):
+        if not isinstance(body, basestring):
+            body = ''.join(iter_body(body))
+        headers = dict((name.lower(), value)
+                       for name, value in headers.items())
+        status, response_headers, content = self.app(method, url, headers,
+                                                     body)
+        return MemoryResponse(status, response_headers, content)
+
+
+class MemoryConnection(object):
+    def connect(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class MemoryResponse(object):
+    """ A response held in memory, read like a httplib response """
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.reason = httplib.responses.get(status, '')
+        self.msg = dict((name.lower(), value)
+                        for name, value in headers.items())
+        self.length = len(body)
+        self._fp = StringIO.StringIO(body)
+
+    def read(self, amt=None):
+        if self._fp is None:
+            return ''
+        if amt is None:
+            data = self._fp.read()
+        else:
+            data = self._fp.read(amt)
+        self.length -= len(data)
+        if not self.length:
+            self.close()
+        return data
+
+    def getheader(self, name, default=None):
+        return self.msg.get(name.lower(), default)
+
+    def getheaders(self):
+        return self.msg.items()
+
+    def isclosed(self):
+        return self._fp is None
+
+    def close(self):
+        self._fp = None
+
+
+class ConnectionPool(object):
+    """
+    A bounded pool of keep-alive HTTP connections to a single host.
+
+    Connections are checked out for the duration of one request and are
+    checked in again once the response has been read or closed. Connections
+    that have been idle for longer than idle_timeout seconds are closed
+    instead of being reused.
+    """
+    def __init__(self, factory, maxsize=10, timeout=None, idle_timeout=60):
+        self.factory = factory
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self._idle = [] # (connection, checkin time), oldest first
+        self._in_use = 0
+        self._cond = threading.Condition(threading.Lock())
+        self._stats = {'created': 0,
+                       'reused': 0,
+                       'evicted': 0,
+                       'discarded': 0,
+                       'waits': 0}
+
+    def get(self):
+        """ Check out a connection, blocking while the pool is exhausted """
+        deadline = None
+        if self.timeout is not None:
+            deadline = time() + self.timeout
+        with self._cond:
+            while True:
+                self._evict()
+                if self._idle:
+                    # the most recently used connection is the least likely
+                    # to have been dropped by the server
+                    conn = self._idle.pop()[0]
+                    self._stats['reused'] += 1
+                    break
+                if self._in_use < self.maxsize:
+                    conn = self.factory()
+                    self._stats['created'] += 1
+                    break
+                self._stats['waits'] += 1
+                if deadline is None:
+                    self._cond.wait()
+                else:
+                    remaining = deadline - time()
+                    if remaining <= 0:
+                        raise APIException('Timed out waiting for a free '
+                                           'connection from the pool')
+                    self._cond.wait(remaining)
+            self._in_use += 1
+        return conn
+
+    def put(self, conn):
+        """ Check a connection back in for reuse """
+        with self._cond:
+            self._in_use -= 1
+            self._idle.append((conn, time()))
+            self._cond.notify()
+
+    def discard(self, conn):
+        """ Close a checked out connection that can not be reused """
+        conn.close()
+        with self._cond:
+            self._in_use -= 1
+            self._stats['discarded'] += 1
+            self._cond.notify()
+
+    def _evict(self):
+        now = time()
+        while self._idle and now - self._idle[0][1] > self.idle_timeout:
+            self._idle.pop(0)[0].close()
+            self._stats['evicted'] += 1
+
+    def stats(self):
+        with self._cond:
+            stats = self._stats.copy()
+            stats['in_use'] = self._in_use
+            stats['idle'] = len(self._idle)
+        return stats
+
+    def close(self):
+        with self._cond:
+            while self._idle:
+                self._idle.pop()[0].close()
+
+
+class PooledResponse(object):
+    """
+    Wraps a response so its connection goes back to the pool as soon as
+    the body has been read completely or the response is closed.
+    """
+    def __init__(self, response, conn, pool):
+        self._response = response
+        self._conn = conn
+        self._pool = pool
+        if response.length == 0:
+            # nothing to read, e.g. 204 No Content
+            self.read()
+
+    def read(self, amt=None):
+        data = self._response.read(amt)
+        if self._response.isclosed():
+            self._release()
+        return data
+
+    def close(self):
+        if self._response.isclosed():
+            self._release()
+        else:
+            # unread data is left on the socket, so it can't be reused
+            self._response.close()
+            self._discard()
+
+    def _release(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.put(conn)
+
+    def _discard(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.discard(conn)
+
+    def __del__(self):
+        self._discard()
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+
 class Connection(object):
     """
     Represents a connection to a Fedora-Commons Repository using the REST API
@@ -31,14 +428,39 @@ class Connection(object):
     """
     def __init__(self, url, debug=False,
                  username=None, password=None, 
-                 persistent=False):
+                 persistent=None, pool_size=None, pool_timeout=None,
+                 idle_timeout=60, retry_policy=None, metrics=None,
+                 transport=None):
         """
          url -- URI pointing to the Fedora server. eg.
          
             http://localhost:8080/fedora/
             
          persistent -- Keep a persistent HTTP connection open.
-                Defaults to true
+                Defaults to true for https urls, where opening a
+                connection costs a TLS handshake, and false otherwise.
+
+         pool_size -- Use a thread-safe pool of at most this many
+                keep-alive connections instead of a single connection.
+
+         pool_timeout -- Seconds to wait for a free pooled connection
+                before giving up, waits forever by default.
+
+         idle_timeout -- Seconds after which an idle pooled connection
+                is closed instead of being reused.
+
+         retry_policy -- A fcrepo.retry.RetryPolicy deciding which failed
+                requests are sent again. By default connection errors and
+                409 Conflict responses are tried 3 times.
+
+         metrics -- A fcrepo.metrics.MetricsRegistry to record the latency,
+                size and retries of every request in.
+
+         transport -- Sends the requests, a HTTPTransport asking for
+                compressed responses by default. Pass a HTTPTransport
+                to configure the CA and client certificates for https.
+                A MemoryTransport sends requests to an app in the same
+                process.
         """        
         self.scheme, self.host, self.path = urlparse.urlparse(url, 'http')[:3]
         self.url = url
@@ -46,9 +468,28 @@ class Connection(object):
         self.password = password
         self.debug = debug
         
+        if persistent is None:
+            persistent = self.scheme == 'https'
         self.persistent = persistent
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.metrics = metrics
+        self.transport = transport or HTTPTransport()
         self.reconnects = 0
-        self.conn = httplib.HTTPConnection(self.host)
+        self.retries = 0
+        self.backoffs = 0
+        self.backoff_time = 0.0
+        self._lock = threading.Lock()
+        self.pool = None
+        self.conn = None
+        if pool_size:
+            # pooled connections are only useful when kept alive
+            self.persistent = True
+            self.pool = ConnectionPool(self._new_connection,
+                                       pool_size,
+                                       pool_timeout,
+                                       idle_timeout)
+        else:
+            self.conn = self._new_connection()
 
         self.form_headers = {}
         
@@ -60,10 +501,20 @@ class Connection(object):
                                 self.password)).encode('base64').strip()
             self.form_headers['Authorization'] = 'Basic %s' % token
         
+    def _new_connection(self):
+        return self.transport.connect(self.scheme, self.host)
+
     def close(self):
-        self.conn.close()
+        if self.pool is not None:
+            self.pool.close()
+        else:
+            self.conn.close()
 
-    def open(self, url, body='', headers=None, method='GET'):
+    def open(self, url, body='', headers=None, method='GET', operation=None):
+        """
+        Sends a request and returns the response. operation names the
+        request in the metrics, it defaults to the HTTP method.
+        """
         if headers is None:
             http_headers = {}
         else:
@@ -72,66 +523,252 @@ class Connection(object):
         if url.startswith('/'):
             url = url[1:]
         url = '%s/%s' % (self.path, url)
+        # httplib joins the request line, headers and a string body, so a
+        # unicode url or header would break binary content
+        if isinstance(url, unicode):
+            url = url.encode('utf8')
+        for name, value in http_headers.items():
+            if isinstance(value, unicode):
+                http_headers[name] = value.encode('utf8')
         
         # Fedora doesn't like a zero length message body when ingesting a datastream.
         if body == '' and (method == 'PUT' or method == 'POST') and 'datastreams/' in url:
             logging.debug('Body empty for HTTP request using'
-                          ' fake form for datastream ingest.')
-            
-            # Establish the mime type and boundary.
+                          ' an empty form for datastream ingest.')
             parsed = urlparse.urlparse(url)
-            mime_type = urlparse.parse_qs(parsed.query)['mimeType']
-            if not mime_type:
-                mime_type = 'application/octet-stream'
-            boundary = '----------ThIs_Is_tHe_bouNdaRY_$'
-            
-            # Build message body.
-            body = (('--{0}{1}Content-Disposition: form-data;'
-                    ' name="file"; filename="IGNORE THE HACK."{1}'
-                    'Content-Type: {2}{1}{1}{1}--{0}--{1}').format(boundary, '\r\n', mime_type))
-            
-            # Change headers for new content type.
-            http_headers.update({
-                'User-Agent': 'INSERT USERAGENTNAME',
-                'Content-Type': 'multipart/form-data; boundary=%s' % boundary
-            })
-        
-        # Send out the request.
-        attempts = 3
-        while attempts:
+            mime_type = urlparse.parse_qs(parsed.query).get(
+                'mimeType', ['application/octet-stream'])[0]
+            body = MultipartEncoder('', mime_type)
+            http_headers['Content-Type'] = body.content_type
+
+        # Remember where a stream starts, so it can be sent again on a retry.
+        position = None
+        if not isinstance(body, basestring):
+            try:
+                position = body.tell()
+            except (AttributeError, IOError, OSError):
+                pass
+
+        metrics = self.metrics
+        if metrics is None:
+            return self._send(url, body, http_headers, method, position)
+        operation = operation or method
+        sent = body_length(body) or 0
+        started = metrics.start(operation)
+        try:
+            response = self._send(url, body, http_headers, method, position,
+                                  operation)
+        except Exception as e:
+            exc_info = sys.exc_info()
+            metrics.finish(operation, getattr(e, 'httpcode', 'error'),
+                           started, sent)
+            raise exc_info[0], exc_info[1], exc_info[2]
+        return metrics.finish(operation, response.status, started, sent,
+                              response)
+
+    def _send(self, url, body, http_headers, method, position,
+              operation=None):
+        attempt = 0
+        stale_retried = False
+        while True:
+            attempt += 1
+            if not self.retry_policy.allow_request(attempt):
+                raise CircuitOpenException('Not sending %s %s, the circuit '
+                                           'breaker is open' % (method, url))
+            conn = None
             try:
+                if attempt > 1 and not isinstance(body, basestring):
+                    if position is None:
+                        raise APIException('Can not retry a request '
+                                           'with a non seekable body')
+                    body.seek(position)
+                conn = self._checkout()
                 logging.debug('Trying %s on %s' % (method, url))
-                # We can't have unicode characters floating around in the body.
-                self.conn.request(method, url, body, http_headers)
-                return check_response_status(self.conn.getresponse())
-            except (socket.error,
-                    httplib.ImproperConnectionState,
-                    httplib.BadStatusLine):
-                    # We include BadStatusLine as they are spurious
-                    # and may randomly happen on an otherwise fine
-                    # connection (though not often)
-                logging.exception('Got an Exception in open')
-                self._reconnect()
-                attempts -= 1
-                if not attempts:
-                    raise
+                response = self.transport.send(conn, method, url, body,
+                                               http_headers)
+                if self.pool is not None:
+                    response = PooledResponse(response, conn, self.pool)
+                response = check_response_status(response)
+                self.retry_policy.record_success()
+                return response
             except FedoraConnectionException as e:
-                attempts -= 1
-                if not attempts or e.httpcode not in [409]:
+                delay = self.retry_policy.retry_status(e.httpcode, attempt)
+                if delay is None:
                     logging.exception('Got HTTP code %s in open...  Failure.' % e.httpcode)
                     raise e
-                else:
-                    logging.exception('Got HTTP code %s in open... Retrying...' % e.httpcode)
-                    self._reconnect()
-                    sleep(5)
-        if not self.persistent:
-           self.close()
+                logging.exception('Got HTTP code %s in open... Retrying...' % e.httpcode)
+                if self.pool is None:
+                    # a pooled connection was already checked back in
+                    # when the error body was read
+                    self._reconnect(operation=operation)
+            except Exception as e:
+                if isinstance(e, CONNECTION_ERRORS):
+                    logging.exception('Got an Exception in open')
+                    self._reconnect(conn, operation)
+                elif self.pool is not None and conn is not None:
+                    self.pool.discard(conn)
+                delay = self.retry_policy.retry_exception(e, attempt)
+                if delay is None:
+                    raise
+                if (getattr(e, 'request_sent', False) and
+                    method not in IDEMPOTENT_METHODS):
+                    if not getattr(e, 'stale', False) or stale_retried:
+                        logging.error('Not sending %s %s again, it may '
+                                      'have been handled already' % (
+                                          method, url))
+                        raise
+                    # once more, on a new connection
+                    stale_retried = True
+                    if self.pool is not None:
+                        # the other idle connections are likely closed too
+                        self.pool.close()
+            self._backoff(delay, operation)
+
+    def _backoff(self, delay, operation=None):
+        with self._lock:
+            self.retries += 1
+            if delay:
+                self.backoffs += 1
+                self.backoff_time += delay
+        if self.metrics is not None:
+            self.metrics.retried(operation)
+        if delay:
+            sleep(delay)
         
-    def _reconnect(self):
-        self.reconnects += 1
+    def _checkout(self):
+        if self.pool is not None:
+            return self.pool.get()
+        return self.conn
+
+    def _reconnect(self, conn=None, operation=None):
+        with self._lock:
+            self.reconnects += 1
+        if self.metrics is not None:
+            self.metrics.reconnected(operation)
+        if self.pool is not None:
+            # drop the broken connection, the next checkout opens a new one
+            if conn is not None:
+                self.pool.discard(conn)
+            return
+        # httplib opens it again for the next request, so a server that is
+        # down fails that attempt and the retry policy sees it
         self.close()
-        self.conn.connect()
         
+class MultipartEncoder(object):
+    """
+    A multipart/form-data body holding a single file, which is streamed
+    instead of being read into memory.
+    """
+    def __init__(self, data, mime_type='application/octet-stream',
+                 filename='content', boundary=None):
+        self.data = data
+        self.boundary = boundary or uuid.uuid4().hex
+        self.content_type = 'multipart/form-data; boundary=%s' % self.boundary
+        self.head = ('--%s\r\n'
+                     'Content-Disposition: form-data; name="file"; '
+                     'filename="%s"\r\n'
+                     'Content-Type: %s\r\n\r\n') % (self.boundary,
+                                                    filename,
+                                                    mime_type)
+        self.tail = '\r\n--%s--\r\n' % self.boundary
+
+    def length(self):
+        size = body_length(self.data)
+        if size is None:
+            return None
+        return len(self.head) + size + len(self.tail)
+
+    def tell(self):
+        if isinstance(self.data, basestring):
+            return 0
+        return self.data.tell()
+
+    def seek(self, position):
+        if not isinstance(self.data, basestring):
+            self.data.seek(position)
+
+    def __iter__(self):
+        yield self.head
+        for chunk in iter_body(self.data):
+            yield chunk
+        yield self.tail
+
+
+def body_length(body):
+    """ Returns the size of a request body in bytes, None if unknown """
+    if isinstance(body, basestring):
+        return len(body)
+    if isinstance(body, MultipartEncoder):
+        return body.length()
+    try:
+        position = body.tell()
+        body.seek(0, 2)
+        size = body.tell() - position
+        body.seek(position)
+        return size
+    except (AttributeError, IOError, OSError):
+        return None
+
+
+def iter_body(body, chunk_size=CHUNK_SIZE):
+    """ Iterates over a string, file-like object or iterable of strings """
+    if isinstance(body, basestring):
+        if body:
+            yield body
+    elif hasattr(body, 'read'):
+        while True:
+            chunk = body.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    else:
+        for chunk in body:
+            yield chunk
+
+
+def iter_lines(fp, chunk_size=CHUNK_SIZE):
+    """ Iterates over the lines read from fp, keeping the line endings """
+    pending = ''
+    while True:
+        chunk = fp.read(chunk_size)
+        if not chunk:
+            break
+        lines = (pending + chunk).splitlines(True)
+        pending = lines.pop()
+        for line in lines:
+            yield line
+    if pending:
+        yield pending
+
+
+def send_stream(conn, method, url, body, headers):
+    """
+    Sends a streamed request body on a httplib connection, with a
+    Content-Length when the size is known or chunked otherwise.
+    """
+    names = [name.lower() for name in headers]
+    conn.putrequest(method, url,
+                    skip_host='host' in names,
+                    skip_accept_encoding='accept-encoding' in names)
+    for name, value in headers.items():
+        conn.putheader(name, value)
+    length = body_length(body)
+    if length is None:
+        conn.putheader('Transfer-Encoding', 'chunked')
+    else:
+        conn.putheader('Content-Length', str(length))
+    conn.endheaders()
+    for chunk in iter_body(body):
+        if not chunk:
+            continue
+        if length is None:
+            conn.send('%x\r\n%s\r\n' % (len(chunk), chunk))
+        else:
+            conn.send(chunk)
+    if length is None:
+        conn.send('0\r\n\r\n')
+
+
 def check_response_status(response):
     if response.status not in (200, 201, 204):
         ex = FedoraConnectionException(response.status, response.reason)
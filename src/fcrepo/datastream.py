@@ -1,11 +1,17 @@
 # Copyright (c) 2010 Infrae / Technical University Delft. All rights reserved.
 # See also LICENSE.txt
 
+import os
 from collections import defaultdict
+from contextlib import contextmanager
+from itertools import chain
+from copy import deepcopy
 
 from lxml import etree
 
-from fcrepo.utils import rdfxml2dict, dict2rdfxml
+from fcrepo.utils import (rdfxml2dict, dict2rdfxml, CHECKSUM_ALGORITHMS,
+                          ChecksumReader)
+from fcrepo.connection import iter_body, APIException, CHUNK_SIZE
     
 class typedproperty(property):
     def __init__(self, fget, fset=None, fdel=None, doc=None, pytype=None):
@@ -25,13 +31,39 @@ class typedproperty(property):
             
         super(typedproperty, self).__init__(typed_get, typed_set, fdel, doc)
 
+def readinto(fp, buffer):
+    """
+    Reads from fp into a bytearray, using fp.readinto when available.
+    Returns the number of bytes read, 0 at the end of the data.
+    """
+    if hasattr(fp, 'readinto'):
+        return fp.readinto(buffer)
+    data = fp.read(len(buffer))
+    count = len(data)
+    buffer[:count] = data
+    return count
+
 class FedoraDatastream(object):
+    # no instance dictionary, many datastreams may be held at once
+    __slots__ = ('object', 'dsid', '_profile', '_pending')
+
     def __init__(self, dsid, object):
         self.object = object
         self.dsid = dsid
-        self._info = self.object.client.getDatastreamProfile(self.object.pid,
-                                                             self.dsid)
+        self._profile = None # load lazy
+        self._pending = None # properties set in a batch
+
+    def _get_info(self):
+        if self._profile is None:
+            self._profile = self.object.client.getDatastreamProfile(
+                self.object.pid, self.dsid)
+        return self._profile
+
+    def _set_info(self, profile):
+        # None makes the profile load again on the next access
+        self._profile = profile
 
+    _info = property(_get_info, _set_info)
         
     def delete(self, **params):
         self.object.client.deleteDatastream(self.object.pid,
@@ -40,33 +72,157 @@ class FedoraDatastream(object):
         self.object._dsids = None
 
     def getContent(self):
-        return self.object.client.getDatastream(self.object.pid, self.dsid)
+        # pass the profile when it's loaded, a content cache needs it
+        return self.object.client.getDatastream(self.object.pid, self.dsid,
+                                                self._profile)
+
+    def iter_content(self, chunk_size=CHUNK_SIZE):
+        """ Iterates over the content in chunks of at most chunk_size bytes """
+        response = self.getContent()
+        try:
+            while True:
+                chunk = response.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            response.close()
+
+    def copy_to(self, fp, buffer=None, verify=False):
+        """
+        Copies the content to fp, a file or other object that can write
+        buffers such as io.BytesIO. The content is read into buffer (a
+        bytearray) which is reused for every chunk. Returns the number of
+        bytes copied. When verify is set the content is checked against
+        the checksum in the datastream profile.
+        """
+        if buffer is None:
+            buffer = bytearray(CHUNK_SIZE)
+        view = memoryview(buffer)
+        response = self.getContent()
+        reader = self._checksum_reader(response, verify)
+        size = 0
+        try:
+            while True:
+                count = readinto(reader, buffer)
+                if not count:
+                    break
+                fp.write(view[:count])
+                size += count
+        finally:
+            response.close()
+        self._verify(reader)
+        return size
+
+    def save_to(self, path, verify=True, chunk_size=CHUNK_SIZE):
+        """
+        Saves the content to a file at path, holding at most one chunk in
+        memory. The file is preallocated when the size of the datastream is
+        known, and removed again when the checksum doesn't match.
+        """
+        size = self.size
+        fp = open(path, 'wb')
+        try:
+            if size > 0:
+                fp.truncate(size)
+            written = self.copy_to(fp, bytearray(chunk_size), verify)
+            # the size in the profile isn't reliable for inline xml
+            fp.truncate(written)
+        except:
+            fp.close()
+            os.remove(path)
+            raise
+        fp.close()
+        return written
+
+    def _checksum_reader(self, response, verify):
+        if not verify or self.checksumType not in CHECKSUM_ALGORITHMS:
+            return response
+        if not self.checksum or self.checksum == 'none':
+            return response
+        return ChecksumReader(response, self.checksumType)
+
+    def _verify(self, reader):
+        if not isinstance(reader, ChecksumReader):
+            return
+        if reader.hexdigest() != self.checksum.lower():
+            raise APIException(
+                'Checksum mismatch on %s/%s: expected %s, got %s' % (
+                    self.object.pid, self.dsid, self.checksum,
+                    reader.hexdigest()))
 
     def setContent(self, data='', **params):
-            
+        """ Saves data as the new content, returns True """
         if self._info['controlGroup'] == 'X':
             # for some reason we need to add 2 characters to the body
             # or we get a parsing error in fedora
-            data += '\r\n'
-        
-        self.object.client.modifyDatastream(self.object.pid,
-                                            self.dsid,
-                                            data,
-                                            **params)
-        self._info = self.object.client.getDatastreamProfile(self.object.pid,
-                                                             self.dsid)
+            if isinstance(data, basestring):
+                data += '\r\n'
+            else:
+                data = chain(iter_body(data), ['\r\n'])
         
+        self._info = self.object.client.modifyDatastream(self.object.pid,
+                                                         self.dsid,
+                                                         data,
+                                                         **params)
+        return True
+
+    def _content_unchanged(self, loaded, current, params):
+        # other params than a log message change the datastream anyway
+        return (loaded is not None and current == loaded and
+                not set(params) - set(['logMessage']))
+
     def _setProperty(self, name, value):
-        msg = u'Changed %s datastream property' % name
-        name = {'label': 'dsLabel',
-                'location': 'dsLocation',
-                'state': 'dsState'}.get(name, name)
-        params = {name: value, 'logMessage': msg, 'ignoreContent': True}
-        self.object.client.modifyDatastream(self.object.pid,
-                                            self.dsid,
-                                            **params)
-        self._info = self.object.client.getDatastreamProfile(self.object.pid,
-                                                             self.dsid)
+        if self._pending is not None:
+            self._pending[name] = value
+            return
+        self._setProperties({name: value})
+
+    def _setProperties(self, properties, logMessage=None):
+        if logMessage is None:
+            if len(properties) == 1:
+                logMessage = u'Changed %s datastream property' % (
+                    properties.keys()[0])
+            else:
+                logMessage = u'Changed %s datastream properties' % (
+                    u', '.join(sorted(properties)))
+        params = {'logMessage': logMessage, 'ignoreContent': True}
+        for name, value in properties.items():
+            name = {'label': 'dsLabel',
+                    'location': 'dsLocation',
+                    'state': 'dsState'}.get(name, name)
+            params[name] = value
+        self._info = self.object.client.modifyDatastream(self.object.pid,
+                                                         self.dsid,
+                                                         **params)
+
+    @contextmanager
+    def batch(self, logMessage=None):
+        """
+        Collects the properties set in the with block and saves them with
+        a single modifyDatastream call when the block ends, which creates a
+        single new version. Properties set to their current value are left
+        out, and nothing is saved if none changed. Nothing is saved either
+        when the block raises an exception.
+        """
+        if self._pending is not None:
+            # nested, the outer block saves
+            yield self
+            return
+        self._pending = {}
+        try:
+            yield self
+            changes = self._pending
+        finally:
+            self._pending = None
+        for name, value in changes.items():
+            current = self._info.get(name)
+            if isinstance(value, bool):
+                value = unicode(value).lower()
+            if value == current:
+                del changes[name]
+        if changes:
+            self._setProperties(changes, logMessage)
 
     label = property(lambda self: self._info['label'],
                      lambda self, value: self._setProperty('label', value))
@@ -100,17 +256,41 @@ class FedoraDatastream(object):
 
 
 
+def _snapshot(predicates):
+    # a copy to compare with, predicates without values are left out as
+    # they aren't serialized
+    return dict((key, deepcopy(values))
+                for key, values in predicates.items() if values)
+
+
 class RELSEXTDatastream(FedoraDatastream):
+    __slots__ = ('_rdf', '_loaded')
+
     def __init__(self, dsid, object):
         super(RELSEXTDatastream, self).__init__(dsid, object)
         self._rdf = None
+        self._loaded = None
+
+    @property
+    def changed(self):
+        """ Whether the relations differ from the saved ones """
+        if self._rdf is None:
+            return False
+        return _snapshot(self._rdf) != self._loaded
 
     def _get_rdf(self):
         if self._rdf is None:
-            rdfxml = self.getContent().read()
-            self._rdf = rdfxml2dict(rdfxml)
+            self._load(self.getContent().read())
         return self._rdf
 
+    def _load(self, rdfxml):
+        self._rdf = rdfxml2dict(rdfxml)
+        self._loaded = _snapshot(self._rdf)
+        graph = self.object.client.graph
+        if graph is not None:
+            graph.set_subject(u'info:fedora/%s' % self.object.pid,
+                              self._rdf)
+
     def keys(self):
         rdf = self._get_rdf()
         keys = rdf.keys()
@@ -119,11 +299,26 @@ class RELSEXTDatastream(FedoraDatastream):
     predicates = keys
     
     def setContent(self, data='', **params):
-        if not data:
-            rdf = self._get_rdf()
-            data = dict2rdfxml(self.object.pid, rdf)
-            self._rdf = None
+        """
+        Saves data, or the relations when no data is given. Returns False
+        without saving when the relations didn't change since they were
+        loaded or saved, so no new version is made, and True otherwise.
+        """
+        if data:
+            self._rdf = self._loaded = None
+            return super(RELSEXTDatastream, self).setContent(data, **params)
+        rdf = self._get_rdf()
+        current = _snapshot(rdf)
+        if self._content_unchanged(self._loaded, current, params):
+            return False
+        data = dict2rdfxml(self.object.pid, rdf)
+        # reloaded when the save fails
+        self._rdf = self._loaded = None
         super(RELSEXTDatastream, self).setContent(data, **params)
+        self._rdf = rdf
+        self._loaded = current
+        return True
+
     def __setitem__(self, key, value):
         rdf = self._get_rdf()
         rdf[key]=value
@@ -145,25 +340,38 @@ class RELSEXTDatastream(FedoraDatastream):
         return rdf.__iter__()
     
 class DCDatastream(FedoraDatastream):
+    __slots__ = ('_dc', '_loaded')
+
     def __init__(self, dsid, object):
         super(DCDatastream, self).__init__(dsid, object)
         self._dc = None
+        self._loaded = None
+
+    @property
+    def changed(self):
+        """ Whether the properties differ from the saved ones """
+        if self._dc is None:
+            return False
+        return _snapshot(self._dc) != self._loaded
 
     def _get_dc(self):
         if self._dc is None:
-            xml = self.getContent().read()
-            doc = etree.fromstring(xml)
-            self._dc = defaultdict(list)
-            for child in doc:
-                name = child.tag.split('}')[-1]
-                value = child.text
-                if value is None:
-                    continue
-                if not isinstance(value, unicode):
-                    value = value.decode('utf8')
-                self._dc[name].append(value)
+            self._load(self.getContent().read())
         return self._dc
 
+    def _load(self, xml):
+        doc = etree.fromstring(xml)
+        self._dc = defaultdict(list)
+        for child in doc:
+            name = child.tag.split('}')[-1]
+            value = child.text
+            if value is None:
+                continue
+            if not isinstance(value, unicode):
+                value = value.decode('utf8')
+            self._dc[name].append(value)
+        self._loaded = _snapshot(self._dc)
+
     def keys(self):
         dc = self._get_dc()
         keys = dc.keys()
@@ -172,19 +380,33 @@ class DCDatastream(FedoraDatastream):
     properties = keys
     
     def setContent(self, data='', **params):
-        if not data:
-            dc = self._get_dc()
-            nsmap = {'dc': 'http://purl.org/dc/elements/1.1/',
-                     'oai_dc': 'http://www.openarchives.org/OAI/2.0/oai_dc/'}
-            doc = etree.Element('{%s}dc' % nsmap['oai_dc'], nsmap=nsmap)
-            for key, values in dc.items():
-                for value in values:
-                    el = etree.SubElement(doc, '{%s}%s' % (nsmap['dc'], key))
-                    el.text = value
-            data = etree.tostring(doc, encoding="UTF-8",
-                                  pretty_print=True, xml_declaration=False)
-            self._dc = None
+        """
+        Saves data, or the properties when no data is given. Returns False
+        without saving when the properties didn't change since they were
+        loaded or saved, so no new version is made, and True otherwise.
+        """
+        if data:
+            self._dc = self._loaded = None
+            return super(DCDatastream, self).setContent(data, **params)
+        dc = self._get_dc()
+        current = _snapshot(dc)
+        if self._content_unchanged(self._loaded, current, params):
+            return False
+        nsmap = {'dc': 'http://purl.org/dc/elements/1.1/',
+                 'oai_dc': 'http://www.openarchives.org/OAI/2.0/oai_dc/'}
+        doc = etree.Element('{%s}dc' % nsmap['oai_dc'], nsmap=nsmap)
+        for key, values in dc.items():
+            for value in values:
+                el = etree.SubElement(doc, '{%s}%s' % (nsmap['dc'], key))
+                el.text = value
+        data = etree.tostring(doc, encoding="UTF-8",
+                              pretty_print=True, xml_declaration=False)
+        # reloaded when the save fails
+        self._dc = self._loaded = None
         super(DCDatastream, self).setContent(data, **params)
+        self._dc = dc
+        self._loaded = current
+        return True
         
     def __setitem__(self, key, value):
         dc = self._get_dc()
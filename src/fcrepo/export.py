@@ -0,0 +1,250 @@
+# Copyright (c) 2010 Infrae / Technical University Delft. All rights reserved.
+# See also LICENSE.txt
+
+import os
+import time
+import shutil
+import logging
+import tarfile
+import zipfile
+import tempfile
+
+from fcrepo.connection import CHUNK_SIZE
+from fcrepo.concurrency import WorkerPool, ThroughputMeter, Result
+from fcrepo.datastream import readinto
+
+logger = logging.getLogger('fcrepo.export')
+
+def export_name(pid):
+    """
+    Returns the path of the export of pid in a target, the PID with the
+    colon replaced by an underscore, in a directory per namespace.
+    """
+    namespace = pid.split(':', 1)[0]
+    return u'%s/%s.xml' % (namespace, pid.replace(u':', u'_', 1))
+
+def export_pid(name):
+    """ Returns the PID of an export name, or None for other files """
+    if isinstance(name, str):
+        name = name.decode('utf8')
+    name = name.replace(os.sep, '/').rsplit('/', 1)[-1]
+    if not name.endswith('.xml') or '_' not in name:
+        return None
+    # namespaces can't contain underscores
+    return name[:-4].replace('_', ':', 1)
+
+
+class DirectoryTarget(object):
+    """ Writes the exports as files in a directory tree """
+    def __init__(self, path):
+        self.path = path
+        # temporary files go in the same file system, to be renamed
+        self.tmp = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def exported(self):
+        pids = set()
+        for dirpath, dirnames, filenames in os.walk(self.path):
+            dirnames[:] = [name for name in dirnames
+                           if not name.startswith('.')]
+            for name in filenames:
+                pid = export_pid(name)
+                if pid is not None:
+                    pids.add(pid)
+        return pids
+
+    def add(self, name, path, size):
+        target = os.path.join(self.path, *name.encode('utf8').split('/'))
+        if not os.path.isdir(os.path.dirname(target)):
+            os.makedirs(os.path.dirname(target))
+        os.rename(path, target)
+
+    def close(self):
+        pass
+
+
+class TarTarget(object):
+    """
+    Writes the exports to a tar archive at path, or to a file object such
+    as sys.stdout. The compression is '', 'gz' or 'bz2'. An existing
+    archive is appended to, which isn't possible for a compressed one.
+    """
+    def __init__(self, path, compression=''):
+        if isinstance(path, basestring):
+            self.tmp = os.path.dirname(os.path.abspath(path))
+            mode = 'w'
+            if os.path.exists(path):
+                if compression:
+                    raise IOError('Can not append to a compressed '
+                                  'archive: %s' % path)
+                mode = 'a'
+            self.tar = tarfile.open(path, '%s:%s' % (mode, compression))
+        else:
+            self.tmp = None
+            self.tar = tarfile.open(fileobj=path,
+                                    mode='w|%s' % compression)
+
+    def exported(self):
+        if self.tar.mode != 'a':
+            return set()
+        return set(pid for pid in (export_pid(name)
+                                   for name in self.tar.getnames())
+                   if pid is not None)
+
+    def add(self, name, path, size):
+        info = tarfile.TarInfo(name.encode('utf8'))
+        info.size = size
+        info.mtime = time.time()
+        fp = open(path, 'rb')
+        try:
+            self.tar.addfile(info, fp)
+        finally:
+            fp.close()
+        os.remove(path)
+
+    def close(self):
+        self.tar.close()
+
+
+class ZipTarget(object):
+    """ Writes the exports to a zip archive, appending to an existing one """
+    def __init__(self, path):
+        self.tmp = os.path.dirname(os.path.abspath(path))
+        mode = 'w'
+        if os.path.exists(path):
+            mode = 'a'
+        self.zip = zipfile.ZipFile(path, mode, zipfile.ZIP_DEFLATED,
+                                   allowZip64=True)
+
+    def exported(self):
+        return set(pid for pid in (export_pid(name)
+                                   for name in self.zip.namelist())
+                   if pid is not None)
+
+    def add(self, name, path, size):
+        # writes the file in chunks
+        self.zip.write(path, name.encode('utf8'))
+        os.remove(path)
+
+    def close(self):
+        self.zip.close()
+
+
+def open_target(path):
+    """
+    Returns the target for path: a tar archive for names ending in .tar,
+    .tar.gz, .tgz or .tar.bz2, a zip archive for .zip and a directory
+    otherwise.
+    """
+    if path.endswith('.tar'):
+        return TarTarget(path)
+    if path.endswith('.tar.gz') or path.endswith('.tgz'):
+        return TarTarget(path, 'gz')
+    if path.endswith('.tar.bz2'):
+        return TarTarget(path, 'bz2')
+    if path.endswith('.zip'):
+        return ZipTarget(path)
+    return DirectoryTarget(path)
+
+
+class BulkExporter(object):
+    """
+    Exports many objects with a pool of worker threads.
+
+    The workers download the exports in chunks to temporary files next
+    to the target, so no object is held in memory, and the files are
+    added to the target in the order of the PIDs. Targets are a
+    DirectoryTarget, TarTarget or ZipTarget, see open_target.
+
+    PIDs are read lazily, so they can come from searchObjects or any
+    other generator. Objects that are in the target already are skipped,
+    so running an interrupted export again resumes it. An archive is
+    closed properly on errors and interrupts, and can't be appended to
+    when it wasn't. A failing object is reported in its result, the
+    other objects are not affected.
+
+    The format and context are passed to FedoraClient.export; with a
+    context of None the FOXML is fetched with getObjectXML instead.
+    Without a pooled connection the objects are exported one after the
+    other.
+    """
+    def __init__(self, client, workers=4,
+                 format=u'info:fedora/fedora-system:FOXML-1.1',
+                 context=u'archive', report_interval=10, reporter=None):
+        self.client = client
+        self.workers = workers
+        self.format = format
+        self.context = context
+        self.meter = ThroughputMeter(report_interval, reporter, 'export')
+
+    def export(self, pids, target):
+        """ Exports pids to target and yields a Result with the name in the target per PID """
+        done = target.exported()
+        tmp = tempfile.mkdtemp(prefix='.export-', dir=target.tmp)
+        workers = self.workers
+        if self.client.api.connection.pool is None:
+            # threads can't share a single connection
+            logger.warning('No pooled connection, exporting without '
+                           'worker threads')
+            workers = 0
+        pool = WorkerPool(workers)
+        try:
+            jobs = ((pid, tmp, pid in done) for pid in pids)
+            for future in pool.map_futures(self._download, jobs):
+                result, path = future.result()
+                if path is not None:
+                    try:
+                        target.add(result.name, path, result.bytes)
+                    except Exception, e:
+                        logger.exception('Adding %s failed' % result.pid)
+                        result.error = e
+                        self._remove(path)
+                        self.meter.add(items=0, errors=1)
+                    else:
+                        self.meter.add(bytes=result.bytes)
+                yield result
+        finally:
+            pool.shutdown()
+            target.close()
+            shutil.rmtree(tmp, ignore_errors=True)
+            self.meter.report()
+
+    def _download(self, job):
+        pid, tmp, skipped = job
+        if skipped:
+            return Result(pid, skipped=True, name=export_name(pid)), None
+        fd, path = tempfile.mkstemp(suffix='.xml', dir=tmp)
+        fp = os.fdopen(fd, 'wb')
+        size = 0
+        try:
+            if self.context is None:
+                response = self.client.getObjectXML(pid)
+            else:
+                response = self.client.export(pid, format=self.format,
+                                              context=self.context)
+            buffer = bytearray(CHUNK_SIZE)
+            view = memoryview(buffer)
+            try:
+                while True:
+                    count = readinto(response, buffer)
+                    if not count:
+                        break
+                    fp.write(view[:count])
+                    size += count
+            finally:
+                response.close()
+            fp.close()
+        except Exception, e:
+            logger.exception('Exporting %s failed' % pid)
+            fp.close()
+            self._remove(path)
+            self.meter.add(items=0, errors=1)
+            return Result(pid, error=e, name=None), None
+        return Result(pid, bytes=size, name=export_name(pid)), path
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
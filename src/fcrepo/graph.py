@@ -0,0 +1,211 @@
+# Copyright (c) 2010 Infrae / Technical University Delft. All rights reserved.
+# See also LICENSE.txt
+
+import threading
+
+class TripleIndex(object):
+    """
+    An in-memory index of RDF triples, answering lookups by subject,
+    predicate or object without a resource index query.
+
+    Subjects and predicates are URIs. Objects are dictionaries as found
+    in a RELS-EXT datastream, with a value and a type of 'uri' or
+    'literal' and optionally a lang or datatype. A plain string is taken
+    for a URI.
+
+    Every term is stored once and referred to by number, for as long as
+    a triple uses it. The triples are kept in three indexes, subject-
+    predicate-object, predicate-object-subject and object-subject-
+    predicate, holding sets of numbers.
+    """
+    def __init__(self):
+        self._ids = {}
+        self._terms = []
+        self._refs = []
+        self._free = []
+        self._spo = {}
+        self._pos = {}
+        self._osp = {}
+        self._size = 0
+        self._lock = threading.RLock()
+
+    def _key(self, object):
+        if isinstance(object, basestring):
+            return object
+        if object['type'] == 'uri':
+            return object['value']
+        return (object['value'], object.get('lang'), object.get('datatype'))
+
+    def _object(self, key):
+        if isinstance(key, tuple):
+            value, lang, datatype = key
+            object = {'value': value, 'type': 'literal'}
+            if lang:
+                object['lang'] = lang
+            elif datatype:
+                object['datatype'] = datatype
+            return object
+        return {'value': key, 'type': 'uri'}
+
+    def _intern(self, key):
+        id = self._ids.get(key)
+        if id is None:
+            if self._free:
+                id = self._free.pop()
+                self._terms[id] = key
+            else:
+                id = len(self._terms)
+                self._terms.append(key)
+                self._refs.append(0)
+            self._ids[key] = id
+        return id
+
+    def _release(self, id):
+        self._refs[id] -= 1
+        if not self._refs[id]:
+            del self._ids[self._terms[id]]
+            self._terms[id] = None
+            self._free.append(id)
+
+    def _lookup(self, key):
+        if key is None:
+            return None
+        return self._ids.get(key, -1)
+
+    def add(self, subject, predicate, object):
+        """ Adds a triple, returns False if it was in the index already """
+        with self._lock:
+            s = self._intern(subject)
+            p = self._intern(predicate)
+            o = self._intern(self._key(object))
+            objects = self._spo.setdefault(s, {}).setdefault(p, set())
+            if o in objects:
+                return False
+            objects.add(o)
+            self._pos.setdefault(p, {}).setdefault(o, set()).add(s)
+            self._osp.setdefault(o, {}).setdefault(s, set()).add(p)
+            for id in (s, p, o):
+                self._refs[id] += 1
+            self._size += 1
+            return True
+
+    def remove(self, subject, predicate, object):
+        """ Removes a triple, returns False if it wasn't in the index """
+        with self._lock:
+            s = self._lookup(subject)
+            p = self._lookup(predicate)
+            o = self._lookup(self._key(object))
+            objects = self._spo.get(s, {}).get(p)
+            if objects is None or o not in objects:
+                return False
+            self._discard(self._spo, s, p, o)
+            self._discard(self._pos, p, o, s)
+            self._discard(self._osp, o, s, p)
+            for id in (s, p, o):
+                self._release(id)
+            self._size -= 1
+            return True
+
+    def _discard(self, index, first, second, third):
+        values = index[first][second]
+        values.discard(third)
+        if not values:
+            del index[first][second]
+            if not index[first]:
+                del index[first]
+
+    def remove_subject(self, subject):
+        """ Removes all triples about subject """
+        with self._lock:
+            for s, p, o in list(self.triples(subject)):
+                self.remove(s, p, o)
+
+    def set_subject(self, subject, predicates):
+        """
+        Replaces the triples about subject by predicates, a dictionary
+        mapping predicates to lists of objects as returned by rdfxml2dict.
+        """
+        with self._lock:
+            self.remove_subject(subject)
+            for predicate, objects in predicates.items():
+                for object in objects:
+                    self.add(subject, predicate, object)
+
+    def triples(self, subject=None, predicate=None, object=None):
+        """
+        Yields the (subject, predicate, object) triples matching the terms
+        that are given, using the index that fits best.
+        """
+        with self._lock:
+            s = self._lookup(subject)
+            p = self._lookup(predicate)
+            o = self._lookup(None if object is None else self._key(object))
+            if s is not None:
+                rows = self._match(self._spo, s, p, o)
+                order = (0, 1, 2)
+            elif p is not None:
+                rows = self._match(self._pos, p, o, None)
+                order = (2, 0, 1)
+            elif o is not None:
+                rows = self._match(self._osp, o, None, None)
+                order = (1, 2, 0)
+            else:
+                rows = self._match(self._spo, None, None, None)
+                order = (0, 1, 2)
+            terms = self._terms
+            result = []
+            for row in rows:
+                result.append((terms[row[order[0]]],
+                               terms[row[order[1]]],
+                               self._object(terms[row[order[2]]])))
+        return iter(result)
+
+    def _match(self, index, first, second, third):
+        if first is None:
+            firsts = index.items()
+        elif first in index:
+            firsts = [(first, index[first])]
+        else:
+            return
+        for a, seconds in firsts:
+            if second is None:
+                items = seconds.items()
+            elif second in seconds:
+                items = [(second, seconds[second])]
+            else:
+                continue
+            for b, thirds in items:
+                for c in thirds:
+                    if third is None or c == third:
+                        yield a, b, c
+
+    def objects(self, subject, predicate):
+        """ Returns the objects of subject for predicate """
+        return [o for s, p, o in self.triples(subject, predicate)]
+
+    def subjects(self, predicate, object):
+        """ Returns the subjects having object for predicate """
+        return [s for s, p, o in self.triples(None, predicate, object)]
+
+    def load(self, rows, names=('s', 'p', 'o')):
+        """
+        Adds the rows of a searchTriples query in the Sparql format that
+        selects a subject, predicate and object, with the given names.
+        Returns the number of triples added.
+        """
+        subject, predicate, object = names
+        added = 0
+        for row in rows:
+            if self.add(row[subject]['value'], row[predicate]['value'],
+                        row[object]):
+                added += 1
+        return added
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, triple):
+        subject, predicate, object = triple
+        for match in self.triples(subject, predicate, object):
+            return True
+        return False
@@ -0,0 +1,135 @@
+# Copyright (c) 2010 Infrae / Technical University Delft. All rights reserved.
+# See also LICENSE.txt
+
+import os
+import logging
+import threading
+
+from fcrepo.connection import body_length
+from fcrepo.concurrency import WorkerPool, ThroughputMeter, Result
+from fcrepo.pids import PIDAllocator
+
+logger = logging.getLogger('fcrepo.ingest')
+
+class BulkIngester(object):
+    """
+    Ingests many objects with a pool of worker threads.
+
+    Objects are described by specs, dictionaries with these keys:
+
+      pid -- The PID of the new object, or
+      namespace -- The namespace to get a new PID from
+      label -- The label of the object
+      state -- The state of the object, defaults to u'A'
+      id -- Optional key identifying the spec in the checkpoint file,
+            defaults to the pid, and for specs with a namespace to the
+            position of the spec in the input, which must then be the
+            same when resuming
+      datastreams -- A list of dictionaries with a dsid, and either the
+            path of a file, or the content as a string, file or iterable.
+            The other keys are passed to addDatastream.
+
+    Specs are read lazily and at most a few per worker are in progress,
+    so specs can come from a generator of any length.
+    PIDs for specs with a namespace are reserved in blocks of
+    pid_block_size.
+    A failing object is deleted again and reported in its result, the
+    other objects are not affected. Without a pooled connection the
+    objects are ingested one after the other. When a checkpoint file is given, the
+    ids of ingested objects are appended to it and specs that are in it
+    already are skipped, so an interrupted run can be resumed.
+    """
+    def __init__(self, client, workers=4, checkpoint=None,
+                 report_interval=10, reporter=None, pid_block_size=100):
+        self.client = client
+        self.workers = workers
+        self.pid_block_size = pid_block_size
+        self.checkpoint = checkpoint
+        self.meter = ThroughputMeter(report_interval, reporter, 'ingest')
+        self._done = set()
+        self._lock = threading.Lock()
+        self._checkpoint_fp = None
+        self._pids = None
+
+    def ingest(self, specs):
+        """ Ingests specs and yields a Result with the spec per spec, in order """
+        if self.checkpoint is not None:
+            if os.path.exists(self.checkpoint):
+                fp = open(self.checkpoint)
+                self._done.update(line.decode('utf8').split(u'\t')[0]
+                                  for line in fp.read().splitlines())
+                fp.close()
+            self._checkpoint_fp = open(self.checkpoint, 'a')
+        self._pids = PIDAllocator(self.client, self.pid_block_size)
+        workers = self.workers
+        if self.client.api.connection.pool is None:
+            # threads can't share a single connection
+            logger.warning('No pooled connection, ingesting without '
+                           'worker threads')
+            workers = 0
+        pool = WorkerPool(workers)
+        try:
+            for future in pool.map_futures(self._ingest, enumerate(specs)):
+                yield future.result()
+        finally:
+            pool.shutdown()
+            self._pids.close()
+            if self._checkpoint_fp is not None:
+                self._checkpoint_fp.close()
+                self._checkpoint_fp = None
+            self.meter.report()
+
+    def _ingest(self, job):
+        index, spec = job
+        key = spec.get('id')
+        if key is None:
+            key = spec.get('pid')
+        if key is None:
+            key = u'#%s' % index
+        # ids read from JSON may be numbers, the checkpoint holds strings
+        key = unicode(key)
+        if key in self._done:
+            return Result(spec.get('pid'), skipped=True, spec=spec)
+        pid = spec.get('pid')
+        created = False
+        size = 0
+        try:
+            if pid is None:
+                pid = self._pids.next(spec['namespace'])
+            self.client.ingestObject(pid, spec.get('label', u''),
+                                     spec.get('state', u'A'))
+            created = True
+            for ds in spec.get('datastreams', ()):
+                size += self._add_datastream(pid, ds)
+        except Exception, e:
+            logger.exception('Ingesting %s failed' % key)
+            if created:
+                try:
+                    self.client.deleteObject(pid, logMessage=u'Failed ingest')
+                except Exception:
+                    logger.exception('Could not remove %s' % pid)
+            self.meter.add(items=0, errors=1)
+            return Result(pid, error=e, spec=spec)
+        with self._lock:
+            self._done.add(key)
+            if self._checkpoint_fp is not None:
+                self._checkpoint_fp.write(('%s\t%s\n' % (key, pid)).encode('utf8'))
+                self._checkpoint_fp.flush()
+        self.meter.add(bytes=size)
+        return Result(pid, bytes=size, spec=spec)
+
+    def _add_datastream(self, pid, ds):
+        params = dict(ds)
+        dsid = params.pop('dsid')
+        path = params.pop('path', None)
+        if path is None:
+            body = params.pop('content', '')
+            size = body_length(body) or 0
+            self.client.addDatastream(pid, dsid, body, **params)
+            return size
+        fp = open(path, 'rb')
+        try:
+            self.client.addDatastream(pid, dsid, fp, **params)
+        finally:
+            fp.close()
+        return os.path.getsize(path)
@@ -0,0 +1,178 @@
+# Copyright (c) 2010 Infrae / Technical University Delft. All rights reserved.
+# See also LICENSE.txt
+
+import logging
+import threading
+from time import time
+from bisect import bisect_left
+from collections import defaultdict
+
+# upper bounds in seconds of the latency buckets, from 1ms to about 90s
+BUCKETS = [0.001 * 2 ** (i / 2.0) for i in range(34)]
+
+class Histogram(object):
+    """ Counts latencies in buckets, percentiles are bucket bounds """
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, percent):
+        if not self.count:
+            return 0.0
+        rank = self.count * percent / 100.0
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class OperationStats(object):
+    def __init__(self):
+        self.latency = Histogram()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def snapshot(self):
+        latency = self.latency
+        return {'count': latency.count,
+                'mean': latency.total / max(latency.count, 1),
+                'max': latency.max,
+                'p50': latency.percentile(50),
+                'p95': latency.percentile(95),
+                'p99': latency.percentile(99),
+                'bytes_sent': self.bytes_sent,
+                'bytes_received': self.bytes_received}
+
+
+class MetricsRegistry(object):
+    """
+    Collects metrics of the requests made through a Connection, per
+    operation (the WADL method id, or the HTTP method for other requests)
+    and HTTP status: latency histograms, bytes sent and received, retries,
+    reconnects and the number of requests in flight.
+
+    The latency is the time until the response headers arrived. Received
+    bytes are counted while the response is read.
+
+    Every interval seconds, and whenever export is called, a snapshot is
+    passed to each of the exporters, callables taking the snapshot as a
+    dictionary. A connection without a registry doesn't collect anything.
+    """
+    def __init__(self, interval=None, exporters=()):
+        self.interval = interval
+        self.exporters = list(exporters)
+        self._lock = threading.Lock()
+        self._exported = time()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._operations = defaultdict(OperationStats)
+            self._retries = defaultdict(int)
+            self._reconnects = defaultdict(int)
+            self._in_flight = defaultdict(int)
+
+    def start(self, operation):
+        """ Counts a request in flight, returns its start time """
+        with self._lock:
+            self._in_flight[operation] += 1
+        return time()
+
+    def finish(self, operation, status, started, sent=0, response=None):
+        """
+        Records a finished request. Returns response wrapped to count the
+        bytes read from it.
+        """
+        latency = time() - started
+        with self._lock:
+            self._in_flight[operation] -= 1
+            stats = self._operations[operation, status]
+            stats.latency.add(latency)
+            stats.bytes_sent += sent
+            due = (self.interval and
+                   time() - self._exported >= self.interval)
+            if due:
+                self._exported = time()
+        if due:
+            self.export()
+        if response is not None:
+            return MeteredResponse(response, self, stats)
+
+    def received(self, stats, count):
+        with self._lock:
+            stats.bytes_received += count
+
+    def retried(self, operation):
+        with self._lock:
+            self._retries[operation] += 1
+
+    def reconnected(self, operation):
+        with self._lock:
+            self._reconnects[operation] += 1
+
+    def snapshot(self):
+        """
+        Returns the metrics as a dictionary with operations, mapping the
+        operations to their statistics per status, and retries, reconnects
+        and in_flight, mapping the operations to counts.
+        """
+        with self._lock:
+            operations = {}
+            for (operation, status), stats in self._operations.items():
+                operations.setdefault(operation, {})[status] = stats.snapshot()
+            return {'operations': operations,
+                    'retries': dict(self._retries),
+                    'reconnects': dict(self._reconnects),
+                    'in_flight': dict((operation, count) for operation, count
+                                      in self._in_flight.items() if count)}
+
+    def export(self):
+        snapshot = self.snapshot()
+        for exporter in self.exporters:
+            try:
+                exporter(snapshot)
+            except Exception:
+                logging.exception('Exporting metrics failed')
+
+
+class MeteredResponse(object):
+    """ Counts the bytes read from a response """
+    def __init__(self, response, registry, stats):
+        self._response = response
+        self._registry = registry
+        self._stats = stats
+
+    def read(self, amt=None):
+        if amt is None:
+            data = self._response.read()
+        else:
+            data = self._response.read(amt)
+        if data:
+            self._registry.received(self._stats, len(data))
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+
+def log_metrics(snapshot):
+    """ An exporter that logs a line per operation and status """
+    for operation, statuses in sorted(snapshot['operations'].items()):
+        for status, stats in sorted(statuses.items()):
+            logging.info('%s %s: %s requests, p50 %.1fms, p95 %.1fms, '
+                         'p99 %.1fms, %s bytes sent, %s bytes received',
+                         operation, status, stats['count'],
+                         stats['p50'] * 1000, stats['p95'] * 1000,
+                         stats['p99'] * 1000, stats['bytes_sent'],
+                         stats['bytes_received'])
@@ -4,33 +4,93 @@
 from fcrepo.datastream import FedoraDatastream, RELSEXTDatastream, DCDatastream
 from fcrepo.connection import FedoraConnectionException
 import logging
+from contextlib import contextmanager
 
 logger = logging.getLogger('fcrepo.object.FedoraObject')
 class FedoraObject(object):
-    def __init__(self, pid, client):
+    # no instance dictionary, many objects may be held at once
+    __slots__ = ('pid', 'client', '_info', '_partial', '_dsids', '_methods',
+                 '_ds_cache', '_pending')
+
+    def __init__(self, pid, client, info=None, partial=False):
+        """
+        info is the object profile, fetched when it's not given. A partial
+        profile, such as the fields of a search result, is completed by
+        fetching the profile once a property missing from it is used.
+        """
         self.pid = pid
         self.client = client
-        self._info = self.client.getObjectProfile(self.pid)
+        if info is None:
+            info = self.client.getObjectProfile(self.pid)
+            partial = False
+        self._info = info
+        self._partial = partial
         self._dsids = None # load lazy
         self._methods = None
         self._ds_cache = {}
+        self._pending = None # properties set in a batch
         
     def _setProperty(self, name, value):
-        msg = u'Changed %s object property' % name
-        kwargs = {name: value, 'logMessage': msg}
+        if self._pending is not None:
+            self._pending[name] = value
+            return
+        self._setProperties({name: value})
+
+    def _setProperties(self, properties, logMessage=None):
+        if logMessage is None:
+            if len(properties) == 1:
+                logMessage = u'Changed %s object property' % (
+                    properties.keys()[0])
+            else:
+                logMessage = u'Changed %s object properties' % (
+                    u', '.join(sorted(properties)))
+        kwargs = dict(properties, logMessage=logMessage)
         self.client.updateObject(self.pid, **kwargs)
         self._info = self.client.getObjectProfile(self.pid)
+        self._partial = False
+
+    def _profile(self, name):
+        if self._partial and name not in self._info:
+            self._info = self.client.getObjectProfile(self.pid)
+            self._partial = False
+        return self._info
+
+    @contextmanager
+    def batch(self, logMessage=None):
+        """
+        Collects the properties set in the with block and saves them with
+        a single updateObject call when the block ends. Properties set to
+        their current value are left out, and nothing is saved if none
+        changed or the block raises an exception.
+        """
+        if self._pending is not None:
+            # nested, the outer block saves
+            yield self
+            return
+        self._pending = {}
+        try:
+            yield self
+            changes = self._pending
+        finally:
+            self._pending = None
+        for name, value in changes.items():
+            if value == self._profile(name).get(name):
+                del changes[name]
+        if changes:
+            self._setProperties(changes, logMessage)
 
-    label = property(lambda self: self._info['label'],
+    label = property(lambda self: self._profile('label')['label'],
                      lambda self, value: self._setProperty('label', value))
-    ownerId = property(lambda self: self._info['ownerId'],
+    ownerId = property(lambda self: self._profile('ownerId')['ownerId'],
                        lambda self, value: self._setProperty('ownerId', value))
-    state = property(lambda self: self._info['state'],
+    state = property(lambda self: self._profile('state')['state'],
                            lambda self, value: self._setProperty('state',
                                                                  value))
     # read only
-    createdDate = property(lambda self: self._info['createdDate'])
-    lastModifiedDate = property(lambda self: self._info['lastModifiedDate'])
+    createdDate = property(
+        lambda self: self._profile('createdDate')['createdDate'])
+    lastModifiedDate = property(
+        lambda self: self._profile('lastModifiedDate')['lastModifiedDate'])
 
     def datastreams(self):
         if self._dsids is None:
@@ -0,0 +1,111 @@
+# Copyright (c) 2010 Infrae / Technical University Delft. All rights reserved.
+# See also LICENSE.txt
+
+import sys
+import logging
+import threading
+from collections import defaultdict, deque
+
+from fcrepo.connection import APIException
+
+logger = logging.getLogger('fcrepo.pids')
+
+class PIDAllocator(object):
+    """
+    Hands out PIDs from blocks reserved with a single getNextPID call, so
+    creating an object doesn't need a request for its PID.
+
+    The allocator is thread-safe. On a pooled connection a new block is
+    reserved in the background as soon as no more than low_water PIDs are
+    left for a namespace, otherwise the calling thread reserves it when
+    the PIDs run out. PIDs that are reserved but never used are lost, so
+    close reports how many are left.
+    """
+    def __init__(self, client, block_size=100, low_water=None):
+        self.client = client
+        self.block_size = block_size
+        if low_water is None:
+            low_water = block_size // 4
+        self.low_water = low_water
+        self.background = client.api.connection.pool is not None
+        self.reserved = 0
+        self.allocated = 0
+        self._pids = defaultdict(deque)
+        self._refills = {}
+        self._errors = {}
+        self._lock = threading.Lock()
+        self._refilled = threading.Condition(self._lock)
+
+    def next(self, namespace):
+        """ Returns an unused PID in namespace """
+        with self._lock:
+            pids = self._pids[namespace]
+            while not pids:
+                error = self._errors.pop(namespace, None)
+                if error is not None:
+                    raise error[0], error[1], error[2]
+                if not self.background:
+                    self._store(namespace, *self._reserve(namespace))
+                elif namespace not in self._refills:
+                    self._start_refill(namespace)
+                else:
+                    self._refilled.wait()
+            pid = pids.popleft()
+            self.allocated += 1
+            if (self.background and len(pids) <= self.low_water and
+                namespace not in self._refills):
+                self._start_refill(namespace)
+            return pid
+
+    def _reserve(self, namespace):
+        try:
+            pids = self.client.getNextPID(namespace, numPIDs=self.block_size)
+            if isinstance(pids, basestring):
+                pids = [pids]
+            if not pids:
+                raise APIException('No PIDs reserved in %s' % namespace)
+        except Exception:
+            return [], sys.exc_info()
+        return pids, None
+
+    def _store(self, namespace, pids, error):
+        self._pids[namespace].extend(pids)
+        self.reserved += len(pids)
+        if error is not None:
+            self._errors[namespace] = error
+
+    def _start_refill(self, namespace):
+        thread = threading.Thread(target=self._refill, args=(namespace,))
+        thread.daemon = True
+        self._refills[namespace] = thread
+        thread.start()
+
+    def _refill(self, namespace):
+        pids, error = self._reserve(namespace)
+        with self._lock:
+            self._store(namespace, pids, error)
+            del self._refills[namespace]
+            self._refilled.notify_all()
+
+    def unused(self):
+        """ Returns the number of reserved PIDs left per namespace """
+        with self._lock:
+            return dict((namespace, len(pids))
+                        for namespace, pids in self._pids.items() if pids)
+
+    def close(self):
+        """
+        Waits for pending reservations and returns the number of PIDs that
+        were reserved but not used per namespace. They are logged as well.
+        """
+        with self._lock:
+            threads = self._refills.values()
+        for thread in threads:
+            thread.join()
+        unused = self.unused()
+        for namespace, count in sorted(unused.items()):
+            logger.info('%s reserved PIDs in namespace %s were not used',
+                        count, namespace)
+        with self._lock:
+            self._pids.clear()
+        return unused
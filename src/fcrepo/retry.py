@@ -0,0 +1,191 @@
+# Copyright (c) 2010 Infrae / Technical University Delft. All rights reserved.
+# See also LICENSE.txt
+
+import socket
+import httplib
+import random
+import threading
+from time import time
+from collections import deque
+
+# errors after which the connection is reopened
+CONNECTION_ERRORS = (socket.error,
+                     httplib.ImproperConnectionState,
+                     # We include BadStatusLine as they are spurious
+                     # and may randomly happen on an otherwise fine
+                     # connection (though not often)
+                     httplib.BadStatusLine)
+
+# statuses that mean the server itself is in trouble, as opposed to the
+# 500 errors Fedora returns for invalid requests
+UNAVAILABLE_STATUSES = (502, 503, 504)
+
+class RetryBudget(object):
+    """
+    Limits the retries to a fraction of the requests made in the last
+    window seconds, so retries can't multiply the load on a server that
+    is already struggling.
+    """
+    def __init__(self, ratio=0.2, minimum=10, window=10):
+        self.ratio = ratio
+        self.minimum = minimum
+        self.window = window
+        self._requests = deque()
+        self._retries = deque()
+        self._lock = threading.Lock()
+
+    def _trim(self, now):
+        for times in (self._requests, self._retries):
+            while times and now - times[0] > self.window:
+                times.popleft()
+
+    def record_request(self):
+        with self._lock:
+            self._requests.append(time())
+
+    def spend(self):
+        """ Returns True if a retry may be made, and counts it """
+        now = time()
+        with self._lock:
+            self._trim(now)
+            allowed = self.minimum + self.ratio * len(self._requests)
+            if len(self._retries) >= allowed:
+                return False
+            self._retries.append(now)
+            return True
+
+
+class CircuitBreaker(object):
+    """
+    Fails requests right away after threshold consecutive failures, for
+    reset_timeout seconds. After that a single trial request is let
+    through, which closes the circuit again when it succeeds.
+    """
+    def __init__(self, threshold=5, reset_timeout=30):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.trips = 0
+        self._opened = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open':
+                if time() - self._opened < self.reset_timeout:
+                    return False
+                self.state = 'half-open'
+                return True
+            # only one trial request at a time
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+
+    def record_failure(self, trial_only=False):
+        """
+        Counts a failed request. With trial_only, for errors that say
+        nothing about the server, only a trial request is failed.
+        """
+        with self._lock:
+            if trial_only and self.state != 'half-open':
+                return
+            self.failures += 1
+            if self.state == 'half-open' or self.failures >= self.threshold:
+                if self.state != 'open':
+                    self.trips += 1
+                self.state = 'open'
+                self._opened = time()
+
+
+class RetryPolicy(object):
+    """
+    Decides whether and after how long a failed request is sent again.
+
+    attempts -- The default number of attempts for a request, including
+          the first one.
+
+    statuses -- Dictionary mapping the HTTP status codes to retry to their
+          number of attempts. Defaults to retrying 409 Conflict.
+
+    exceptions -- Dictionary mapping the exception classes to retry to
+          their number of attempts. Defaults to retrying connection errors.
+
+    backoff -- The delay in seconds before the first retry, which doubles
+          for every next retry up to max_backoff. A connection error is
+          retried right away the first time, since it's usually caused by
+          a keep-alive connection that was closed by the server.
+
+    jitter -- Wait a random time between 0 and the delay, so clients that
+          failed at the same time don't all retry at the same time.
+
+    budget -- An optional RetryBudget shared by all requests.
+
+    breaker -- An optional CircuitBreaker shared by all requests.
+    """
+    def __init__(self, attempts=3, statuses=None, exceptions=None,
+                 backoff=0.5, max_backoff=30, jitter=True,
+                 budget=None, breaker=None):
+        self.attempts = attempts
+        if statuses is None:
+            statuses = {409: attempts}
+        if exceptions is None:
+            exceptions = dict((cls, attempts) for cls in CONNECTION_ERRORS)
+        self.statuses = statuses
+        self.exceptions = exceptions
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.budget = budget
+        self.breaker = breaker
+
+    def allow_request(self, attempt):
+        if self.breaker is not None and not self.breaker.allow():
+            return False
+        if self.budget is not None and attempt == 1:
+            self.budget.record_request()
+        return True
+
+    def record_success(self):
+        if self.breaker is not None:
+            self.breaker.record_success()
+
+    def retry_status(self, status, attempt):
+        """ Returns the delay before retrying, or None to give up """
+        if self.breaker is not None:
+            if status in UNAVAILABLE_STATUSES:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+        return self._delay(self.statuses.get(status), attempt)
+
+    def retry_exception(self, exception, attempt):
+        """ Returns the delay before retrying, or None to give up """
+        if self.breaker is not None:
+            # any error ends a trial request, or the circuit stays half-open
+            self.breaker.record_failure(
+                trial_only=not isinstance(exception, CONNECTION_ERRORS))
+        for cls, attempts in self.exceptions.items():
+            if isinstance(exception, cls):
+                break
+        else:
+            return None
+        if attempt == 1 and isinstance(exception, CONNECTION_ERRORS):
+            return self._delay(attempts, attempt, 0)
+        return self._delay(attempts, attempt)
+
+    def _delay(self, attempts, attempt, delay=None):
+        if not attempts or attempt >= attempts:
+            return None
+        if self.budget is not None and not self.budget.spend():
+            return None
+        if delay is None:
+            delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+            if self.jitter:
+                delay = random.uniform(0, delay)
+        return delay
@@ -5,6 +5,7 @@ import sys
 import os
 import subprocess
 import tempfile
+from optparse import OptionParser
 from ConfigParser import ConfigParser
 
 
@@ -116,3 +117,154 @@ def start_fedora():
                {'path': fedora_path})
     os.system(cmd)
 
+
+
+def connection_options(parser):
+    parser.add_option('--url', default='http://%s:%s/fedora' % (FEDORA_HOST,
+                                                                 FEDORA_PORT))
+    parser.add_option('--username', default='fedoraAdmin')
+    parser.add_option('--password', default=FEDORA_PASSWD)
+
+
+def print_throughput(stats):
+    print >> sys.stderr, ('%(items)s done, %(errors)s failed, '
+                          '%(items_per_sec).1f/s, %(mb_per_sec).2f MB/s '
+                          'in %(elapsed).0fs' % stats)
+
+
+def compile_wadl():
+    parser = OptionParser(usage='%prog [options] OUTPUT',
+                          description='Compile the WADL of a Fedora server '
+                          'into a method table, which can be passed to '
+                          'FedoraClient as wadl_table.')
+    connection_options(parser)
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error('expected the path of the output file')
+
+    from fcrepo.connection import Connection
+    from fcrepo.wadl import API, save_table
+    connection = Connection(options.url,
+                            username=options.username,
+                            password=options.password)
+    api = API(connection)
+    save_table(api.table, args[0])
+    print '%s methods written to %s' % (len(api.table['methods']), args[0])
+
+
+def bulk_ingest():
+    parser = OptionParser(usage='%prog [options] SPECS',
+                          description='Ingest the objects described in '
+                          'SPECS, a file with an object spec as JSON on '
+                          'every line (see fcrepo.ingest.BulkIngester), '
+                          'or - to read from stdin.')
+    connection_options(parser)
+    parser.add_option('--workers', type='int', default=4)
+    parser.add_option('--checkpoint',
+                      help='File to record ingested objects in, rerunning '
+                      'with the same file skips those objects')
+    parser.add_option('--report-interval', type='int', default=10)
+    parser.add_option('--pid-block-size', type='int', default=100,
+                      help='Number of PIDs to reserve at once for specs '
+                      'with a namespace')
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error('expected the path of a specs file')
+
+    import json
+    from fcrepo.connection import Connection
+    from fcrepo.client import FedoraClient
+    from fcrepo.ingest import BulkIngester
+    connection = Connection(options.url,
+                            username=options.username,
+                            password=options.password,
+                            # one more for reserving PIDs
+                            pool_size=options.workers + 1)
+    client = FedoraClient(connection)
+    ingester = BulkIngester(client,
+                            workers=options.workers,
+                            checkpoint=options.checkpoint,
+                            report_interval=options.report_interval,
+                            reporter=print_throughput,
+                            pid_block_size=options.pid_block_size)
+    if args[0] == '-':
+        fp = sys.stdin
+    else:
+        fp = open(args[0])
+    specs = (json.loads(line) for line in fp if line.strip())
+    failed = 0
+    for result in ingester.ingest(specs):
+        if result.error is not None:
+            failed += 1
+            print >> sys.stderr, ('%s failed: %s' % (
+                result.spec.get('id') or result.pid, result.error))
+    if failed:
+        sys.exit(1)
+
+
+def bulk_export():
+    parser = OptionParser(usage='%prog [options] OUTPUT',
+                          description='Export objects to OUTPUT, a tar '
+                          '(.tar, .tar.gz, .tgz, .tar.bz2) or zip (.zip) '
+                          'archive, a directory, or - for a tar archive on '
+                          'stdout. Objects that are in OUTPUT already are '
+                          'skipped, so an interrupted export can be '
+                          'resumed by running it again.')
+    connection_options(parser)
+    parser.add_option('--query',
+                      help='Export the objects matching this searchObjects '
+                      'query, such as pid~demo:*')
+    parser.add_option('--pids',
+                      help='File with a PID on every line, or - to read '
+                      'from stdin')
+    parser.add_option('--format',
+                      default='info:fedora/fedora-system:FOXML-1.1')
+    parser.add_option('--context', default='archive',
+                      help='public, migrate or archive, or objectXML to '
+                      'get the FOXML as stored (default %default)')
+    parser.add_option('--workers', type='int', default=4)
+    parser.add_option('--report-interval', type='int', default=10)
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error('expected the path of the output')
+    if (options.query is None) == (options.pids is None):
+        parser.error('expected either --query or --pids')
+
+    from fcrepo.connection import Connection
+    from fcrepo.client import FedoraClient
+    from fcrepo.export import BulkExporter, TarTarget, open_target
+    connection = Connection(options.url,
+                            username=options.username,
+                            password=options.password,
+                            # one more for searching
+                            pool_size=options.workers + 1)
+    client = FedoraClient(connection)
+    context = options.context.decode('utf8')
+    if context == u'objectXML':
+        context = None
+    exporter = BulkExporter(client,
+                            workers=options.workers,
+                            format=options.format.decode('utf8'),
+                            context=context,
+                            report_interval=options.report_interval,
+                            reporter=print_throughput)
+    if options.query is not None:
+        pids = (row['pid'][0] for row in client.searchObjects(
+            options.query.decode('utf8'), ['pid'], maxResults=100))
+    else:
+        if options.pids == '-':
+            fp = sys.stdin
+        else:
+            fp = open(options.pids)
+        pids = (line.strip().decode('utf8') for line in fp if line.strip())
+    if args[0] == '-':
+        target = TarTarget(sys.stdout)
+    else:
+        target = open_target(args[0])
+    failed = 0
+    for result in exporter.export(pids, target):
+        if result.error is not None:
+            failed += 1
+            print >> sys.stderr, '%s failed: %s' % (result.pid, result.error)
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,650 @@
+# Copyright (c) 2010 Infrae / Technical University Delft. All rights reserved.
+# See also LICENSE.txt
+"""
+An in-process stand-in for a Fedora 3 server, for benchmarks and tests
+that shouldn't need a running repository.
+
+It implements the parts of the REST API this package uses: the WADL,
+object and datastream profiles and content, findObjects with paging,
+getNextPID, export and the resource index, which answers every query
+with the RELS-EXT triples of all objects. Queries are not interpreted
+beyond a trailing limit and offset. Everything is kept in memory.
+
+  server = FedoraServer().start()
+  client = FedoraClient(Connection(server.url))
+  ...
+  server.stop()
+
+or without sockets, through a MemoryTransport:
+
+  app = FedoraApp()
+  connection = Connection('http://localhost:8080/fedora',
+                          transport=MemoryTransport(app))
+"""
+import re
+import sys
+import gzip
+import socket
+import hashlib
+import fnmatch
+import datetime
+import threading
+import urlparse
+import StringIO
+import SocketServer
+import BaseHTTPServer
+from xml.sax.saxutils import escape
+
+from fcrepo.utils import CHECKSUM_ALGORITHMS, rdfxml2dict
+
+ACCESS_NS = 'http://www.fedora.info/definitions/1/0/access/'
+MANAGEMENT_NS = 'http://www.fedora.info/definitions/1/0/management/'
+TYPES_NS = 'http://www.fedora.info/definitions/1/0/types/'
+FOXML_NS = 'info:fedora/fedora-system:def/foxml#'
+RESULT_NS = 'http://www.w3.org/2001/sw/DataAccess/rf1/result'
+
+DC_XML = ('<oai_dc:dc '
+          'xmlns:oai_dc="http://www.openarchives.org/OAI/2.0/oai_dc/" '
+          'xmlns:dc="http://purl.org/dc/elements/1.1/">'
+          '<dc:title>%s</dc:title><dc:identifier>%s</dc:identifier>'
+          '</oai_dc:dc>')
+
+# the part of the WADL of Fedora 3.4 that the client uses
+FEDORA_WADL = '''<?xml version="1.0"?>
+<application xmlns="http://research.sun.com/wadl/2006/10">
+<resources base="http://localhost:8080/fedora">
+<resource path="/objects">
+ <method id="searchObjects" name="GET"><request>
+  <param name="terms" type="xs:string" style="query"/>
+  <param name="query" type="xs:string" style="query"/>
+  <param name="maxResults" type="xs:int" style="query" default="25"/>
+  <param name="resultFormat" type="xs:string" style="query" default="text/html"/>
+  <param name="sessionToken" type="xs:string" style="query"/>
+ </request></method>
+ <resource path="nextPID">
+  <method id="getNextPID" name="POST"><request>
+   <param name="numPIDs" type="xs:int" style="query" default="1"/>
+   <param name="namespace" type="xs:string" style="query"/>
+   <param name="format" type="xs:string" style="query" default="text/html"/>
+  </request></method>
+ </resource>
+ <resource path="{pid}">
+  <method id="getObjectProfile" name="GET"><request>
+   <param name="format" type="xs:string" style="query" default="text/html"/>
+  </request></method>
+  <method id="createObject" name="POST"><request>
+   <param name="label" type="xs:string" style="query"/>
+   <param name="state" type="xs:string" style="query"/>
+   <param name="logMessage" type="xs:string" style="query"/>
+  </request></method>
+  <method id="updateObject" name="PUT"><request>
+   <param name="label" type="xs:string" style="query"/>
+   <param name="ownerId" type="xs:string" style="query"/>
+   <param name="state" type="xs:string" style="query"/>
+   <param name="logMessage" type="xs:string" style="query"/>
+  </request></method>
+  <method id="deleteObject" name="DELETE"><request>
+   <param name="logMessage" type="xs:string" style="query"/>
+  </request></method>
+  <resource path="export">
+   <method id="export" name="GET"><request>
+    <param name="format" type="xs:string" style="query"/>
+    <param name="context" type="xs:string" style="query"/>
+    <param name="encoding" type="xs:string" style="query"/>
+   </request></method>
+  </resource>
+  <resource path="objectXML">
+   <method id="getObjectXML" name="GET"/>
+  </resource>
+  <resource path="methods">
+   <method id="getAllObjectMethods" name="GET"><request>
+    <param name="format" type="xs:string" style="query"/>
+   </request></method>
+  </resource>
+  <resource path="datastreams">
+   <method id="listDatastreams" name="GET"><request>
+    <param name="format" type="xs:string" style="query" default="text/html"/>
+   </request></method>
+   <resource path="{dsID}">
+    <method id="getDatastreamProfile" name="GET"><request>
+     <param name="format" type="xs:string" style="query" default="text/html"/>
+    </request></method>
+    <method id="addDatastream" name="POST"><request>
+     <param name="controlGroup" type="xs:string" style="query"/>
+     <param name="dsLocation" type="xs:string" style="query"/>
+     <param name="altIDs" type="xs:string" style="query"/>
+     <param name="dsLabel" type="xs:string" style="query"/>
+     <param name="versionable" type="xs:boolean" style="query"/>
+     <param name="dsState" type="xs:string" style="query"/>
+     <param name="formatURI" type="xs:string" style="query"/>
+     <param name="checksumType" type="xs:string" style="query"/>
+     <param name="checksum" type="xs:string" style="query"/>
+     <param name="mimeType" type="xs:string" style="query"/>
+     <param name="logMessage" type="xs:string" style="query"/>
+    </request></method>
+    <method id="modifyDatastream" name="PUT"><request>
+     <param name="dsLocation" type="xs:string" style="query"/>
+     <param name="altIDs" type="xs:string" style="query"/>
+     <param name="dsLabel" type="xs:string" style="query"/>
+     <param name="versionable" type="xs:boolean" style="query"/>
+     <param name="dsState" type="xs:string" style="query"/>
+     <param name="formatURI" type="xs:string" style="query"/>
+     <param name="checksumType" type="xs:string" style="query"/>
+     <param name="checksum" type="xs:string" style="query"/>
+     <param name="mimeType" type="xs:string" style="query"/>
+     <param name="logMessage" type="xs:string" style="query"/>
+     <param name="ignoreContent" type="xs:boolean" style="query"/>
+     <param name="lastModifiedDate" type="xs:string" style="query"/>
+    </request></method>
+    <method id="deleteDatastream" name="DELETE"><request>
+     <param name="logMessage" type="xs:string" style="query"/>
+    </request></method>
+    <resource path="content">
+     <method id="getDatastream" name="GET"><request>
+      <param name="asOfDateTime" type="xs:string" style="query"/>
+     </request></method>
+    </resource>
+   </resource>
+  </resource>
+ </resource>
+</resource>
+</resources>
+</application>'''
+
+class Repository(object):
+    """ The objects held by a FedoraServer """
+    def __init__(self):
+        self.objects = {}
+        self.lock = threading.Lock()
+        # (method, path) of every request, to count round trips
+        self.requests = []
+        # statuses to answer the next requests with, e.g. [409] or [503]
+        self.fail = []
+        self._counter = 0
+        self._last_time = None
+
+    def now(self):
+        # timestamps increase with every change, like in Fedora
+        now = datetime.datetime.utcnow()
+        if self._last_time is not None and now <= self._last_time:
+            now = self._last_time + datetime.timedelta(milliseconds=1)
+        self._last_time = now
+        return now.strftime('%Y-%m-%dT%H:%M:%S.') + '%03dZ' % (
+            now.microsecond // 1000)
+
+    def next_pids(self, namespace, count):
+        pids = []
+        for i in range(count):
+            self._counter += 1
+            pids.append('%s:%s' % (namespace, self._counter))
+        return pids
+
+    def triples(self):
+        for pid, obj in sorted(self.objects.items()):
+            ds = obj['datastreams'].get('RELS-EXT')
+            if ds is None:
+                continue
+            subject = 'info:fedora/%s' % pid
+            for predicate, objects in rdfxml2dict(ds['content']).items():
+                for object in objects:
+                    yield subject, predicate, object
+
+
+def datastream_profile(pid, dsid, ds):
+    return ('<datastreamProfile xmlns="%s" pid="%s" dsID="%s">'
+            '<dsLabel>%s</dsLabel>'
+            '<dsVersionID>%s.%s</dsVersionID>'
+            '<dsCreateDate>%s</dsCreateDate>'
+            '<dsState>%s</dsState>'
+            '<dsMIME>%s</dsMIME>'
+            '<dsFormatURI>%s</dsFormatURI>'
+            '<dsControlGroup>%s</dsControlGroup>'
+            '<dsSize>%s</dsSize>'
+            '<dsVersionable>%s</dsVersionable>'
+            '<dsInfoType></dsInfoType>'
+            '<dsLocation>%s+%s+%s.%s</dsLocation>'
+            '<dsLocationType>INTERNAL_ID</dsLocationType>'
+            '<dsChecksumType>%s</dsChecksumType>'
+            '<dsChecksum>%s</dsChecksum>'
+            '</datastreamProfile>') % (
+        MANAGEMENT_NS, pid, dsid, escape(ds['label']), dsid, ds['version'],
+        ds['created'], ds['state'], escape(ds['mimeType']),
+        escape(ds['formatURI']), ds['controlGroup'], len(ds['content']),
+        ds['versionable'], pid, dsid, dsid, ds['version'],
+        ds['checksumType'], ds['checksum'])
+
+def checksum(ds):
+    algorithm = CHECKSUM_ALGORITHMS.get(ds['checksumType'])
+    if algorithm is None:
+        return 'none'
+    return hashlib.new(algorithm, ds['content']).hexdigest()
+
+NTRIPLES_ESCAPES = {'\\': '\\\\', '"': '\\"', '\n': '\\n', '\r': '\\r',
+                    '\t': '\\t'}
+
+def ntriples(term):
+    if isinstance(term, basestring) or term['type'] == 'uri':
+        if not isinstance(term, basestring):
+            term = term['value']
+        return '<%s>' % term
+    # tabs and newlines would break the rows of the TSV format
+    return '"%s"' % re.sub(r'[\\"\n\r\t]',
+                           lambda match: NTRIPLES_ESCAPES[match.group()],
+                           term['value'])
+
+
+class FedoraApp(object):
+    """
+    Answers REST API requests from a Repository. It's called with the
+    HTTP method, the path and query of the url, the request headers as a
+    dictionary with lower case names and the body, and returns the status,
+    the response headers and the body. FedoraServer serves it over HTTP,
+    a fcrepo.connection.MemoryTransport calls it directly.
+
+    With compress set, responses of 1 KB and more are gzip encoded for
+    clients that accept it, like Tomcat does when compression is on.
+    """
+    def __init__(self, repository=None, path='/fedora', compress=False):
+        if repository is None:
+            repository = Repository()
+        self.repository = repository
+        self.path = path
+        self.compress = compress
+
+    def __call__(self, method, url, headers, body):
+        repository = self.repository
+        url = urlparse.urlparse(url)
+        params = dict((name, values[0]) for name, values in
+                      urlparse.parse_qs(url.query).items())
+        path = urlparse.unquote(url.path)
+        content_type = headers.get('content-type', '')
+        if content_type.startswith('multipart/form-data'):
+            boundary = content_type.split('boundary=')[1]
+            part = body.split('--' + boundary)[1]
+            body = part.split('\r\n\r\n', 1)[1][:-2]
+        with repository.lock:
+            repository.requests.append((method, path))
+            if repository.fail:
+                return self.send(repository.fail.pop(0), 'Failure',
+                                 'text/plain')
+            prefix = self.path + '/'
+            if not path.startswith(prefix):
+                return self.send(404, 'Not Found', 'text/plain')
+            parts = path[len(prefix):].split('/')
+            status, response_headers, body = self.route(
+                repository, method, parts, params, body)
+        if (self.compress and len(body) >= 1024 and
+            'gzip' in headers.get('accept-encoding', '')):
+            buffer = StringIO.StringIO()
+            fp = gzip.GzipFile(fileobj=buffer, mode='wb')
+            fp.write(body)
+            fp.close()
+            body = buffer.getvalue()
+            response_headers['Content-Encoding'] = 'gzip'
+        return status, response_headers, body
+
+    def send(self, status, body='', content_type='text/xml'):
+        if isinstance(body, unicode):
+            body = body.encode('utf8')
+        return status, {'Content-Type': content_type}, body
+
+    def route(self, repository, method, parts, params, body):
+        if parts == ['objects', 'application.wadl']:
+            return self.send(200, FEDORA_WADL)
+        if parts == ['risearch']:
+            return self.risearch(repository, params)
+        if parts == ['objects', 'nextPID']:
+            pids = repository.next_pids(params['namespace'],
+                                        int(params.get('numPIDs', 1)))
+            return self.send(200, '<pidList xmlns="%s">%s</pidList>' % (
+                MANAGEMENT_NS, ''.join('<pid>%s</pid>' % pid
+                                       for pid in pids)))
+        if parts == ['objects']:
+            return self.find_objects(repository, params)
+        if len(parts) < 2 or parts[0] != 'objects':
+            return self.send(404, 'Not Found', 'text/plain')
+        pid = parts[1]
+        obj = repository.objects.get(pid)
+        if len(parts) == 2:
+            if method == 'POST':
+                return self.ingest(repository, pid, obj, params)
+            if obj is None:
+                return self.send(404, 'No object %s' % pid, 'text/plain')
+            return self.object(repository, method, pid, obj, params)
+        if obj is None:
+            return self.send(404, 'No object %s' % pid, 'text/plain')
+        if parts[2] in ('export', 'objectXML') and len(parts) == 3:
+            return self.send(200, self.foxml(pid, obj))
+        if parts[2] == 'methods':
+            return self.send(200, '<objectMethods xmlns="%s" pid="%s"/>' % (
+                ACCESS_NS, pid))
+        if parts[2] != 'datastreams':
+            return self.send(404, 'Not Found', 'text/plain')
+        if len(parts) == 3:
+            return self.send(200, '<objectDatastreams xmlns="%s">%s'
+                             '</objectDatastreams>' % (ACCESS_NS, ''.join(
+                '<datastream dsid="%s" label="%s" mimeType="%s"/>' % (
+                    dsid, escape(ds['label'], {'"': '&quot;'}),
+                    ds['mimeType'])
+                for dsid, ds in sorted(obj['datastreams'].items()))))
+        return self.datastream(repository, method, pid, obj, parts[3],
+                               parts[4:], params, body)
+
+    def ingest(self, repository, pid, obj, params):
+        if obj is not None:
+            return self.send(500, "The PID '%s' already exists in the "
+                             "registry; the object can't be re-created." % pid,
+                             'text/plain')
+        now = repository.now()
+        label = params.get('label', '').decode('utf8')
+        repository.objects[pid] = obj = {
+            'label': label, 'state': params.get('state', 'A'),
+            'ownerId': '', 'created': now, 'modified': now,
+            'datastreams': {}}
+        obj['datastreams']['DC'] = self.new_datastream(
+            repository, DC_XML % (escape(label).encode('utf8'), pid),
+            {'dsLabel': 'Dublin Core Record for this object',
+             'mimeType': 'text/xml', 'controlGroup': 'X',
+             'formatURI': 'http://www.openarchives.org/OAI/2.0/oai_dc/'})
+        return self.send(201, pid, 'text/plain')
+
+    def object(self, repository, method, pid, obj, params):
+        if method == 'GET':
+            return self.send(200, '<objectProfile xmlns="%s" pid="%s">'
+                             '<objLabel>%s</objLabel>'
+                             '<objOwnerId>%s</objOwnerId>'
+                             '<objCreateDate>%s</objCreateDate>'
+                             '<objLastModDate>%s</objLastModDate>'
+                             '<objState>%s</objState>'
+                             '</objectProfile>' % (
+                ACCESS_NS, pid, escape(obj['label']),
+                escape(obj['ownerId']), obj['created'],
+                obj['modified'], obj['state']))
+        if method == 'PUT':
+            if params.get('state', 'A') not in ('A', 'I', 'D'):
+                return self.send(500, 'The object state of "%s" is invalid. '
+                                 'The allowed values for state are:  A '
+                                 '(active), D (deleted), and I (inactive).' % (
+                                     params['state']), 'text/plain')
+            for name in ('label', 'ownerId', 'state'):
+                if name in params:
+                    obj[name] = params[name].decode('utf8')
+            obj['modified'] = repository.now()
+            return self.send(200, obj['modified'], 'text/plain')
+        if method == 'DELETE':
+            del repository.objects[pid]
+            return self.send(204)
+        return self.send(405, 'Method Not Allowed', 'text/plain')
+
+    def new_datastream(self, repository, content, params):
+        ds = {'label': params.get('dsLabel', '').decode('utf8'),
+              'mimeType': params.get('mimeType', ''),
+              'formatURI': params.get('formatURI', ''),
+              'controlGroup': params.get('controlGroup', 'X'),
+              'checksumType': params.get('checksumType', 'DISABLED'),
+              'state': params.get('dsState', 'A'),
+              'versionable': params.get('versionable', 'true'),
+              'created': repository.now(),
+              'version': 0,
+              'content': content}
+        ds['checksum'] = checksum(ds)
+        return ds
+
+    def datastream(self, repository, method, pid, obj, dsid, rest, params,
+                   body):
+        datastreams = obj['datastreams']
+        ds = datastreams.get(dsid)
+        if method == 'POST' and not rest:
+            if ds is not None:
+                return self.send(500, 'Datastream %s already exists' % dsid,
+                                 'text/plain')
+            if params.get('controlGroup', 'X') == 'X':
+                body = body.strip()
+            datastreams[dsid] = ds = self.new_datastream(repository, body,
+                                                         params)
+            obj['modified'] = ds['created']
+            return self.send(201, datastream_profile(pid, dsid, ds))
+        if ds is None:
+            return self.send(404, 'No datastream could be found. Either '
+                             'there is no datastream for the digital object '
+                             '"%s" with datastream ID of "%s"' % (pid, dsid),
+                             'text/plain')
+        if rest == ['content']:
+            return self.send(200, ds['content'],
+                             ds['mimeType'] or 'application/octet-stream')
+        if method == 'GET':
+            return self.send(200, datastream_profile(pid, dsid, ds))
+        if method == 'PUT':
+            for name, param in (('mimeType', 'mimeType'),
+                                ('formatURI', 'formatURI'),
+                                ('checksumType', 'checksumType'),
+                                ('state', 'dsState'),
+                                ('versionable', 'versionable')):
+                if param in params:
+                    ds[name] = params[param]
+            if 'dsLabel' in params:
+                ds['label'] = params['dsLabel'].decode('utf8')
+            if params.get('ignoreContent') != 'true' and body:
+                if ds['controlGroup'] == 'X':
+                    body = body.strip()
+                ds['content'] = body
+            ds['checksum'] = checksum(ds)
+            ds['version'] += 1
+            ds['created'] = obj['modified'] = repository.now()
+            return self.send(200, datastream_profile(pid, dsid, ds))
+        if method == 'DELETE':
+            del datastreams[dsid]
+            obj['modified'] = repository.now()
+            return self.send(200, '[]', 'text/plain')
+        return self.send(405, 'Method Not Allowed', 'text/plain')
+
+    def foxml(self, pid, obj):
+        return ('<foxml:digitalObject xmlns:foxml="%s" VERSION="1.1" '
+                'PID="%s"><foxml:objectProperties>'
+                '<foxml:property NAME="%s" VALUE="%s"/>'
+                '<foxml:property NAME="%s" VALUE="%s"/>'
+                '</foxml:objectProperties>%s</foxml:digitalObject>') % (
+            FOXML_NS, pid,
+            'info:fedora/fedora-system:def/model#state', obj['state'],
+            'info:fedora/fedora-system:def/model#label',
+            escape(obj['label'], {'"': '&quot;'}),
+            ''.join('<foxml:datastream ID="%s" CONTROL_GROUP="%s"/>' % (
+                dsid, ds['controlGroup'])
+                for dsid, ds in sorted(obj['datastreams'].items())))
+
+    def find_objects(self, repository, params):
+        matches = []
+        for pid, obj in sorted(repository.objects.items()):
+            values = {'pid': pid, 'label': obj['label'],
+                      'state': obj['state'], 'ownerId': obj['ownerId']}
+            if 'terms' in params:
+                pattern = params['terms'].decode('utf8').lower()
+                if not (fnmatch.fnmatchcase(pid.lower(), pattern) or
+                        fnmatch.fnmatchcase(obj['label'].lower(), pattern)):
+                    continue
+            else:
+                for condition in params.get('query', '').split():
+                    name, operator, pattern = re.match(
+                        r'(\w+)(~|=)(.*)', condition).groups()
+                    value = values.get(name, u'')
+                    pattern = pattern.decode('utf8')
+                    if operator == '=' and value != pattern:
+                        break
+                    if (operator == '~' and
+                        not fnmatch.fnmatchcase(value, pattern)):
+                        break
+                else:
+                    matches.append((pid, obj))
+                continue
+            matches.append((pid, obj))
+        start = int(params.get('sessionToken', 0))
+        size = int(params.get('maxResults', 25))
+        session = ''
+        if start + size < len(matches):
+            session = ('<listSession><token>%s</token><cursor>%s</cursor>'
+                       '</listSession>' % (start + size, start))
+        results = []
+        for pid, obj in matches[start:start + size]:
+            fields = {'pid': pid, 'label': obj['label'],
+                      'state': obj['state'], 'ownerId': obj['ownerId'],
+                      'cDate': obj['created'], 'mDate': obj['modified'],
+                      'title': obj['label']}
+            results.append('<objectFields>%s</objectFields>' % ''.join(
+                '<%s>%s</%s>' % (name, escape(value), name)
+                for name, value in sorted(fields.items())
+                if params.get(name) == 'true'))
+        return self.send(200, '<result xmlns="%s">%s<resultList>%s'
+                         '</resultList></result>' % (
+            TYPES_NS, session, ''.join(results)))
+
+    def risearch(self, repository, params):
+        rows = list(repository.triples())
+        match = re.search(r'limit (\d+) offset (\d+)\s*$',
+                          params.get('query', ''), re.I)
+        if match:
+            limit, offset = int(match.group(1)), int(match.group(2))
+            rows = rows[offset:offset + limit]
+        if params.get('limit'):
+            rows = rows[:int(params['limit'])]
+        format = params.get('format', 'Sparql')
+        if format == 'count':
+            return self.send(200, '%s\n' % len(rows), 'text/plain')
+        if format == 'CSV':
+            lines = ['s,p,o']
+            for row in rows:
+                values = [row[0], row[1], row[2]['value']]
+                lines.append(','.join('"%s"' % value.replace('"', '""')
+                                      for value in values))
+            return self.send(200, '\r\n'.join(lines) + '\r\n',
+                             'text/plain')
+        if format == 'TSV':
+            lines = ['?s\t?p\t?o']
+            for row in rows:
+                lines.append('\t'.join(ntriples(term) for term in row))
+            return self.send(200, '\n'.join(lines) + '\n',
+                             'text/plain')
+        results = []
+        for subject, predicate, object in rows:
+            if object['type'] == 'uri':
+                o = '<o uri="%s"/>' % escape(object['value'], {'"': '&quot;'})
+            else:
+                o = '<o>%s</o>' % escape(object['value'] or u'')
+            results.append('<result><s uri="%s"/><p uri="%s"/>%s</result>' % (
+                subject, predicate, o))
+        return self.send(200, ('<sparql xmlns="%s"><head><variable name="s"/>'
+                               '<variable name="p"/><variable name="o"/>'
+                               '</head><results>%s</results></sparql>' % (
+            RESULT_NS, u''.join(results))))
+
+
+class FedoraHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # send the response in one go instead of a packet per header
+    wbufsize = -1
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def do_PUT(self):
+        self.handle_request('PUT')
+
+    def do_DELETE(self):
+        self.handle_request('DELETE')
+
+    def read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(';')[0], 16)
+                if not size:
+                    self.rfile.readline()
+                    break
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+            return ''.join(chunks)
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def handle_request(self, method):
+        body = ''
+        if method in ('POST', 'PUT'):
+            body = self.read_body()
+        # the headers of the request look up names case insensitively
+        status, headers, body = self.server.app(method, self.path,
+                                                self.headers, body)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        if self.headers.get('Connection', '').lower() == 'close':
+            self.send_header('Connection', 'close')
+            self.close_connection = 1
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FedoraServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    Serves a FedoraApp over HTTP on a free local port, until stop is
+    called. Use url to connect to it. With an ssl.SSLContext holding the
+    server certificate, it's served over HTTPS.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0, path='/fedora',
+                 compress=False, ssl_context=None):
+        BaseHTTPServer.HTTPServer.__init__(self, (host, port), FedoraHandler)
+        scheme = 'http'
+        if ssl_context is not None:
+            scheme = 'https'
+            self.socket = ssl_context.wrap_socket(self.socket,
+                                                  server_side=True)
+        self.url = '%s://%s:%s%s' % (scheme, host, self.server_address[1],
+                                     path)
+        self.app = FedoraApp(path=path, compress=compress)
+        self.repository = self.app.repository
+        self._thread = None
+        self._requests = set()
+        self._lock = threading.Lock()
+
+    def process_request(self, request, client_address):
+        with self._lock:
+            self._requests.add(request)
+        SocketServer.ThreadingMixIn.process_request(self, request,
+                                                   client_address)
+
+    def handle_error(self, request, client_address):
+        # clients going away, on purpose or not, are no errors here
+        if not isinstance(sys.exc_info()[1], socket.error):
+            BaseHTTPServer.HTTPServer.handle_error(self, request,
+                                                   client_address)
+
+    def shutdown_request(self, request):
+        with self._lock:
+            self._requests.discard(request)
+        BaseHTTPServer.HTTPServer.shutdown_request(self, request)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
+        # end the keep-alive connections clients left open
+        with self._lock:
+            requests = list(self._requests)
+        for request in requests:
+            try:
+                request.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
@@ -1,7 +1,7 @@
 # Copyright (c) 2010 Infrae / Technical University Delft. All rights reserved.
 # See also LICENSE.txt
 
-
+import hashlib
 from collections import defaultdict
 
 from lxml import etree
@@ -67,6 +67,57 @@ class Namespace(unicode):
 NS = Namespaces(NAMESPACES)
 NSXML = 'http://www.w3.org/XML/1998/namespace'
 
+# Fedora checksumType names mapped to hashlib algorithms
+CHECKSUM_ALGORITHMS = {'MD5': 'md5',
+                       'SHA-1': 'sha1',
+                       'SHA-256': 'sha256',
+                       'SHA-384': 'sha384',
+                       'SHA-512': 'sha512'}
+
+class ChecksumReader(object):
+    """
+    Wraps a file-like object or an iterable of strings and computes a
+    checksum of the data while it is being read.
+    """
+    def __init__(self, data, checksumType=u'MD5'):
+        self.data = data
+        self.checksumType = checksumType
+        self._hash = hashlib.new(CHECKSUM_ALGORITHMS[checksumType])
+        self._iter = None
+        self._start = None
+        if hasattr(data, 'tell'):
+            try:
+                self._start = data.tell()
+            except (IOError, OSError):
+                pass
+        if not hasattr(data, 'read'):
+            self._iter = iter(data)
+
+    def read(self, size=-1):
+        if self._iter is None:
+            chunk = self.data.read(size)
+        else:
+            # an empty string would be taken for the end of the data
+            for chunk in self._iter:
+                if chunk:
+                    break
+            else:
+                chunk = ''
+        self._hash.update(chunk)
+        return chunk
+
+    def tell(self):
+        return self.data.tell()
+
+    def seek(self, offset, whence=0):
+        self.data.seek(offset, whence)
+        if whence == 0 and offset == self._start:
+            # the data will be read again from the start
+            self._hash = hashlib.new(CHECKSUM_ALGORITHMS[self.checksumType])
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
 def dict2rdfxml(subject, predicates):
     rdf = ElementMaker(namespace=NS.rdf, nsmap=dict(NS))
     doc = rdf.RDF()
@@ -1,26 +1,96 @@
 # Copyright (c) 2010 Infrae / Technical University Delft. All rights reserved.
 # See also LICENSE.txt
 
+import os
+import json
+import logging
 import urllib
+import hashlib
+import tempfile
+from time import time
 
 from lxml import etree
 
 NSMAP = {'wadl': 'http://research.sun.com/wadl/2006/10'}
 
+PARAM_TYPES = {'xs:int': int,
+               'xs:boolean': bool,
+               'xs:string': unicode}
+
+def compile_wadl(wadl_xml):
+    """
+    Compiles a WADL document into a method table, a dictionary that maps
+    each method id to its HTTP method, url template and request params.
+    The table is plain data, so it can be stored as JSON.
+    """
+    doc = etree.fromstring(wadl_xml)
+    methods = {}
+
+    def walk(resource, paths):
+        for child in resource:
+            if child.tag == '{%s}resource' % NSMAP['wadl']:
+                walk(child, paths + [child.attrib['path']])
+            elif child.tag == '{%s}method' % NSMAP['wadl']:
+                url = u'/'.join(paths)
+                url = url.replace('//', '/').replace(
+                    '%', '%%').replace('{', '%(').replace('}', ')s')
+                # XXX hack to fix broken fedora wadl.
+                if not url.startswith('/objects'):
+                    url = '/objects%s' % url
+                params = []
+                for param in child.xpath('wadl:request/wadl:param',
+                                         namespaces=NSMAP):
+                    params.append([param.attrib['name'],
+                                   param.attrib['type'],
+                                   param.attrib.get('default')])
+                methods[child.attrib['id']] = {'name': child.attrib['name'],
+                                               'url': url,
+                                               'params': params}
+
+    for resources in doc.xpath('//wadl:resources', namespaces=NSMAP):
+        walk(resources, [])
+    return {'hash': hashlib.sha1(wadl_xml).hexdigest(),
+            'methods': methods}
+
+logger = logging.getLogger('fcrepo.wadl')
+
+def load_table(path):
+    fp = open(path, 'rb')
+    try:
+        return json.load(fp)
+    finally:
+        fp.close()
+
+def save_table(table, path):
+    # write to a temporary file first, so concurrent processes never
+    # read a half written table
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.')
+    fp = os.fdopen(fd, 'wb')
+    try:
+        json.dump(table, fp)
+    finally:
+        fp.close()
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        # windows does not rename over existing files
+        os.remove(path)
+        os.rename(tmp_path, path)
+
 class WADLMethod(object):
-    def __init__(self, id, name, api):
+    def __init__(self, id, name, api, url=None, params=()):
         self.id = id
         self.api = api
         self.name = name
-        self.url = u'/'.join(self.api.doc.xpath(
-            '//wadl:method[@id="%s"]//ancestor::wadl:resource/@path' % self.id,
-            namespaces=NSMAP))
-        self.url = self.url.replace('//', '/').replace(
-            '%', '%%').replace('{', '%(').replace('}', ')s')
-
-        # XXX hack to fix broken fedora wadl.
-        if not self.url.startswith('/objects'):
-            self.url = '/objects%s' % self.url
+        self.url = url
+        # resolved once and shared by all requests, which must not
+        # modify them
+        self.param_types = {}
+        self.default_values = {}
+        for param_name, type_name, default_value in params:
+            self.param_types[param_name] = PARAM_TYPES[type_name]
+            if default_value:
+                self.default_values[param_name] = default_value
         
     def __call__(self, **params):
         url = self.url % params
@@ -31,28 +101,21 @@ class WADLRequest(object):
         self.url = url
         self.method = method
         self.headers = self.method.api.connection.form_headers.copy()
-
-        self.param_types = {}
+        self.param_types = self.method.param_types
         self.undocumented_params = {} # needed in searchOjbects
-        self.default_values = {}
-        
-        for param in self.method.api.doc.xpath(
-            '//wadl:method[@id="%s"]/wadl:request/wadl:param' % self.method.id,
-            namespaces=NSMAP):
-            name = param.attrib['name']
-            param_type = {'xs:int': int,
-                          'xs:boolean': bool,
-                          'xs:string': unicode}[param.attrib['type']]
-            self.param_types[name] = param_type
-            default_value = param.attrib.get('default')
-            if default_value:
-                self.default_values[name] = default_value
+        self.default_values = self.method.default_values
         
 
     def submit(self, body='', **params):
         qs = self.default_values.copy()
         for param, value in params.items():
             param_type = self.param_types.get(param)
+            if param_type is None and self.method.api.revalidate():
+                # the param may be new on the server, the url stays
+                self.method = getattr(self.method.api, self.method.id)
+                self.param_types = self.method.param_types
+                self.default_values = self.method.default_values
+                return self.submit(body, **params)
             if param_type is None:
                 raise KeyError('Method "%s" has no param "%s"' % (
                     self.method.id, param))
@@ -65,7 +128,7 @@ class WADLRequest(object):
                     value.__class__))
             
             if param_type is bool:
-                value = unicode(param_type).lower()
+                value = unicode(value).lower()
             value = unicode(value)
             qs[param] = value
         for param, value in self.undocumented_params.items():
@@ -82,19 +145,124 @@ class WADLRequest(object):
         return self.method.api.connection.open(self.url,
                                                body,
                                                self.headers,
-                                               method=self.method.name)
+                                               method=self.method.name,
+                                               operation=self.method.id)
     
 class API(object):
-    def __init__(self, connection):
+    """
+    The Fedora REST API, generated from the WADL file of the server.
+
+    table -- A compiled method table, or the path of a JSON file holding
+          one, as written by the compile_wadl script. Using a table means
+          no WADL has to be downloaded.
+
+    cache_dir -- Directory where the compiled method table is cached per
+          server url, so only the first client for a server downloads the
+          WADL file. Remove the file, or call refresh, to replace it.
+
+    cache_max_age -- Seconds after which a cached table is checked against
+          the WADL of the server again.
+
+    A table from a file or the cache is refreshed from the server once
+    when a method or param is used that it doesn't have, as happens after
+    Fedora was upgraded.
+    """
+    def __init__(self, connection, table=None, cache_dir=None,
+                 cache_max_age=86400):
         self.connection = connection
+        self.cache_path = None
+        self.cache_max_age = cache_max_age
+        # whether the table was downloaded by this API
+        self._fresh = False
+        if cache_dir is not None:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            key = hashlib.sha1(self.connection.url).hexdigest()
+            self.cache_path = os.path.join(cache_dir, '%s.json' % key)
+        if isinstance(table, basestring):
+            table = load_table(table)
+        if table is not None:
+            self._load(table)
+            return
+        table = self._cached_table(self.cache_max_age)
+        if table is not None:
+            try:
+                self._load(table)
+                return
+            except Exception:
+                logger.exception('Invalid cached method table %s, '
+                                 'compiling the WADL again' % self.cache_path)
+                # refresh only writes tables that differ from the cached one
+                os.remove(self.cache_path)
+        self.refresh()
+
+    def _cached_table(self, max_age=None):
+        """
+        Returns the cached method table, or None if there is none or it
+        was last checked more than max_age seconds ago.
+        """
+        if self.cache_path is None or not os.path.exists(self.cache_path):
+            return None
+        try:
+            if (max_age is not None and
+                time() - os.path.getmtime(self.cache_path) > max_age):
+                return None
+            table = load_table(self.cache_path)
+            if 'hash' not in table or 'methods' not in table:
+                raise ValueError('Not a method table')
+        except Exception:
+            # a corrupt or truncated file is replaced by refresh
+            logger.exception('Could not read the cached method table %s'
+                             % self.cache_path)
+            return None
+        return table
+
+    def refresh(self):
+        """
+        Downloads and compiles the WADL file, and updates the cached
+        method table when the WADL has changed.
+        """
         # hack for APIA auth
         fp = self.connection.open('/objects/application.wadl', headers=self.connection.form_headers)
         wadl_xml = fp.read()
         fp.close()
-        self.doc = etree.fromstring(wadl_xml)
-        for method in self.doc.xpath('//wadl:method',
-                                     namespaces=NSMAP):
-            method_id = method.attrib['id']
-            method_name = method.attrib['name']
-            self.__dict__[method_id] = WADLMethod(method_id, method_name, self)
-        
+        table = compile_wadl(wadl_xml)
+        if self.cache_path is not None:
+            cached = self._cached_table()
+            if cached is None or cached['hash'] != table['hash']:
+                save_table(table, self.cache_path)
+            else:
+                # checked now, the age counts from here
+                os.utime(self.cache_path, None)
+        self._load(table)
+        self._fresh = True
+        return table
+
+    def revalidate(self):
+        """
+        Refreshes a table that wasn't downloaded by this API. Returns
+        whether it did, which happens at most once.
+        """
+        if self._fresh:
+            return False
+        logger.info('Refreshing the method table of %s' % self.connection.url)
+        self.refresh()
+        return True
+
+    def __getattr__(self, name):
+        # only called for missing attributes, such as methods that are new
+        # on the server
+        if not name.startswith('_') and self.__dict__.get('_fresh') is False:
+            self.revalidate()
+            if name in self.__dict__:
+                return self.__dict__[name]
+        raise AttributeError(name)
+
+    def _load(self, table):
+        self.table = table
+        for method_id, method in table['methods'].items():
+            self.__dict__[method_id] = WADLMethod(method_id,
+                                                  str(method['name']),
+                                                  self,
+                                                  method['url'],
+                                                  method['params'])